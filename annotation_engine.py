@@ -0,0 +1,217 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from scipy.ndimage import label as ndi_label, find_objects
+from skimage import io, color, segmentation
+from segmentation_storage import SegmentationStorage, SegmentationEntry
+from superpixel_backends import get_backend, DEFAULT_BACKEND
+from coco_io import mask_to_polygons, polygons_to_mask, PolygonExportSettings
+
+# Jádro anotace bez Qt: používá ho SuperpixelAnnotator i HTTP služba (annotation_service)
+
+DEFAULT_SEGMENTS = 100
+
+
+def load_rgb_image(path: str) -> np.ndarray:
+    image = io.imread(path)
+    if image.ndim == 2:
+        image = color.gray2rgb(image)
+    return image
+
+
+def superpixel_edges(segments: np.ndarray) -> np.ndarray:
+    return segmentation.find_boundaries(segments, mode='thick')
+
+
+def label_components(border_mask: np.ndarray):
+    """
+    Komponenty = souvislé oblasti mimo hranice (superpixelů i ručních).
+    Vrací (labels, slices) - slices z find_objects, index = id - 1.
+    """
+    labels, _ = ndi_label(~border_mask)
+    return labels, find_objects(labels)
+
+
+def mask_to_bbox(mask: np.ndarray) -> List[int]:
+    ys, xs = np.where(mask)
+    if len(xs) == 0 or len(ys) == 0:
+        return [0, 0, 0, 0]
+    x_min, x_max = xs.min(), xs.max()
+    y_min, y_max = ys.min(), ys.max()
+    return [int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)]
+
+
+def build_coco_annotation(annotation_id: int, mask: np.ndarray, label: str,
+                          settings: Optional[PolygonExportSettings] = None) -> dict:
+    mask = np.asarray(mask).astype(np.uint8)
+    return {
+        "id": annotation_id,
+        "category_id": 1,
+        "segmentation": mask_to_polygons(mask, settings),
+        "area": float(np.sum(mask)),
+        "bbox": mask_to_bbox(mask),
+        "iscrowd": 0,
+        "label": label
+    }
+
+
+def coco_annotation_from_entry(entry: SegmentationEntry,
+                               settings: Optional[PolygonExportSettings] = None) -> dict:
+    """
+    COCO anotace (s 'label') ze záznamu storage. Importovaný záznam se vrací v kódované
+    podobě ze souboru (polygony/RLE) bez dekódování masky, ostatní se vektorizují z masky.
+    """
+    encoded = entry.encoded
+    if encoded is None:
+        return build_coco_annotation(entry.id, entry.get_mask(), entry.label, settings)
+    area, bbox = encoded.get('area'), encoded.get('bbox')
+    if area is None or not bbox:
+        # Soubor bez area/bbox - maska se dekóduje jen dočasně
+        was_decoded = entry.mask is not None
+        mask = entry.get_mask().astype(bool)
+        if not was_decoded:
+            entry.release_mask()
+        area, bbox = float(np.sum(mask)), mask_to_bbox(mask)
+    return {
+        "id": entry.id,
+        "category_id": 1,
+        "segmentation": encoded['segmentation'],
+        "area": float(area),
+        "bbox": list(bbox),
+        "iscrowd": int(encoded.get('iscrowd', 0)),
+        "label": entry.label
+    }
+
+
+def entry_from_coco_annotation(coco_ann: dict, image_path: str, shape: Tuple[int, int]) -> SegmentationEntry:
+    # Maska ve storage odpovídá exportovaným polygonům, ne pixelovému výběru
+    return SegmentationEntry(
+        id=coco_ann['id'],
+        image_path=image_path,
+        label=coco_ann['label'],
+        mask=polygons_to_mask(coco_ann['segmentation'], shape[0], shape[1]),
+        polygon=None,
+        color=None
+    )
+
+
+def build_coco_json(images: List[dict]) -> dict:
+    """
+    images: [{'file_name', 'width', 'height', 'annotations': [coco anotace s 'label']}].
+    Kategorie se tvoří z labelů v pořadí prvního výskytu.
+    """
+    coco_images = []
+    annotations = []
+    categories = []
+    cat_map = {}
+    for image_id, image in enumerate(images, start=1):
+        coco_images.append({
+            "id": image_id,
+            "file_name": image['file_name'],
+            "width": image['width'],
+            "height": image['height']
+        })
+        for ann in image['annotations']:
+            annotations.append({k: v for k, v in ann.items() if k != 'label'})
+            if ann['label'] not in cat_map:
+                cat_id = len(cat_map) + 1
+                cat_map[ann['label']] = cat_id
+                categories.append({"id": cat_id, "name": ann['label']})
+            annotations[-1]['category_id'] = cat_map[ann['label']]
+            annotations[-1]['image_id'] = image_id
+    return {
+        "images": coco_images,
+        "annotations": annotations,
+        "categories": categories
+    }
+
+
+class AnnotationSession:
+    """
+    Stav anotace jednoho obrázku bez GUI: superpixely, komponenty a potvrzené anotace.
+    Výběr drží klient a posílá ho jako seznam id komponent.
+    """
+
+    def __init__(self, image: np.ndarray, image_path: str = '', storage: Optional[SegmentationStorage] = None):
+        self.image = image
+        self.image_path = image_path
+        # Rozměr zůstává i po uvolnění obrázku (služba ho z cache vyhazuje), stačí pro export
+        self.size: Tuple[int, int] = tuple(image.shape[:2])
+        # Volitelné zrcadlení anotací do SegmentationStorage; bez něj (služba) se nic navíc nedrží
+        self.storage = storage
+        self.superpixel_labels = None
+        self.component_labels = None
+        self.component_slices = []
+        self.annotations: List[dict] = []
+        self.next_annotation_id = 1
+
+    @classmethod
+    def from_file(cls, path: str, storage: Optional[SegmentationStorage] = None) -> 'AnnotationSession':
+        return cls(load_rgb_image(path), path, storage)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.size
+
+    def segment(self, backend: str = DEFAULT_BACKEND, n_segments: int = DEFAULT_SEGMENTS) -> int:
+        # Nová segmentace mění id komponent, potvrzené anotace (pixelové masky) zůstávají
+        self.superpixel_labels = get_backend(backend).segment(self.image, n_segments)
+        self.component_labels, self.component_slices = label_components(superpixel_edges(self.superpixel_labels))
+        return len(self.component_slices)
+
+    def component_at(self, x: int, y: int) -> int:
+        # 0 = hranice nebo mimo obrázek
+        if self.component_labels is None:
+            raise RuntimeError("Obrázek ještě není segmentovaný")
+        h, w = self.shape
+        if not (0 <= x < w and 0 <= y < h):
+            return 0
+        return int(self.component_labels[y, x])
+
+    def selection_mask(self, component_ids: Iterable[int]) -> np.ndarray:
+        if self.component_labels is None:
+            raise RuntimeError("Obrázek ještě není segmentovaný")
+        lut = np.zeros(len(self.component_slices) + 1, dtype=bool)
+        ids = np.asarray([c for c in component_ids if 0 < int(c) < len(lut)], dtype=np.int64)
+        lut[ids] = True
+        return lut[self.component_labels]
+
+    def commit(self, component_ids: Iterable[int], label: str,
+               settings: Optional[PolygonExportSettings] = None) -> Optional[dict]:
+        """
+        Uloží výběr komponent jako anotaci (COCO dict s 'label'), je-li nastavené storage,
+        přidá ji i tam (zakódovanou, maska se dekóduje až při čtení). Prázdný výběr vrací None.
+        """
+        mask = self.selection_mask(component_ids)
+        if not mask.any():
+            return None
+        annotation_id = self.next_annotation_id
+        self.next_annotation_id += 1
+        coco_ann = build_coco_annotation(annotation_id, mask, label or f'object_{annotation_id}', settings)
+        self.annotations.append(coco_ann)
+        if self.storage is not None:
+            h, w = self.shape
+            self.storage.add_segmentation(SegmentationEntry(
+                id=annotation_id,
+                image_path=self.image_path,
+                label=coco_ann['label'],
+                mask=None,
+                encoded={'segmentation': coco_ann['segmentation'], 'height': h, 'width': w,
+                         'bbox': coco_ann['bbox'], 'area': coco_ann['area'], 'iscrowd': 0}
+            ))
+        return coco_ann
+
+    def remove(self, annotation_id: int) -> bool:
+        before = len(self.annotations)
+        self.annotations = [a for a in self.annotations if a['id'] != annotation_id]
+        if self.storage is not None:
+            self.storage.remove_segmentation_by_id(self.image_path, annotation_id)
+        return len(self.annotations) != before
+
+    def image_record(self) -> Dict:
+        # Vstup pro build_coco_json
+        h, w = self.shape
+        return {'file_name': self.image_path.replace('\\', '/').split('/')[-1] or 'image.png',
+                'width': w, 'height': h, 'annotations': self.annotations}
+
+    def to_coco_json(self) -> dict:
+        return build_coco_json([self.image_record()])
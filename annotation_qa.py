@@ -0,0 +1,176 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass, field
+import numpy as np
+from segmentation_storage import SegmentationStorage, SegmentationEntry
+
+ISSUE_EMPTY = 'empty'
+ISSUE_TINY = 'tiny'
+ISSUE_OVERLAP = 'overlap'
+ISSUE_DUPLICATE = 'duplicate'
+
+
+@dataclass
+class QAIssue:
+    kind: str  # ISSUE_EMPTY / ISSUE_TINY / ISSUE_OVERLAP / ISSUE_DUPLICATE
+    image_path: str
+    ids: Tuple[int, ...]
+    value: float = 0.0  # plocha u empty/tiny, IoU u overlap/duplicate
+    same_label: bool = False
+
+
+@dataclass
+class QAReport:
+    issues: List[QAIssue] = field(default_factory=list)
+    checked_images: int = 0
+    checked_annotations: int = 0
+    candidate_pairs: int = 0
+
+    def by_kind(self, kind: str) -> List[QAIssue]:
+        return [i for i in self.issues if i.kind == kind]
+
+    def by_image(self) -> Dict[str, List[QAIssue]]:
+        result: Dict[str, List[QAIssue]] = {}
+        for issue in self.issues:
+            result.setdefault(issue.image_path, []).append(issue)
+        return result
+
+    def summary(self) -> Dict[str, int]:
+        counts = {kind: 0 for kind in (ISSUE_EMPTY, ISSUE_TINY, ISSUE_OVERLAP, ISSUE_DUPLICATE)}
+        for issue in self.issues:
+            counts[issue.kind] += 1
+        return counts
+
+
+@dataclass
+class CompactMask:
+    # Maska oříznutá na bbox (y0, y1, x0, x1) + plocha
+    bbox: Tuple[int, int, int, int]
+    crop: np.ndarray
+    area: int
+
+    @classmethod
+    def from_mask(cls, mask: Optional[np.ndarray]) -> 'CompactMask':
+        if mask is None:
+            return cls((0, 0, 0, 0), np.zeros((0, 0), dtype=bool), 0)
+        mask = np.asarray(mask) > 0
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return cls((0, 0, 0, 0), np.zeros((0, 0), dtype=bool), 0)
+        cols = np.flatnonzero(mask.any(axis=0))
+        y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+        crop = mask[y0:y1, x0:x1]
+        return cls((y0, y1, x0, x1), crop, int(np.count_nonzero(crop)))
+
+
+def candidate_pairs(boxes: np.ndarray) -> np.ndarray:
+    """
+    Sweep přes osu x: boxy (N, 4) jako (y0, y1, x0, x1) se seřadí podle x0 a pro každý
+    se vektorově prověří jen ty, které začínají před jeho koncem. Vrací páry indexů (M, 2)
+    s nenulovým průnikem bboxů.
+    """
+    n = len(boxes)
+    if n < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    order = np.argsort(boxes[:, 2], kind='stable')
+    sorted_boxes = boxes[order]
+    x0s = sorted_boxes[:, 2]
+    ends = np.searchsorted(x0s, sorted_boxes[:, 3], side='left')
+    pairs = []
+    for i in range(n):
+        if ends[i] <= i + 1:
+            continue
+        others = sorted_boxes[i + 1:ends[i]]
+        hit = (others[:, 0] < sorted_boxes[i, 1]) & (others[:, 1] > sorted_boxes[i, 0])
+        js = np.flatnonzero(hit) + i + 1
+        if len(js):
+            pairs.append(np.stack([np.full(len(js), order[i]), order[js]], axis=1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+def mask_iou(a: CompactMask, b: CompactMask) -> float:
+    y0, y1 = max(a.bbox[0], b.bbox[0]), min(a.bbox[1], b.bbox[1])
+    x0, x1 = max(a.bbox[2], b.bbox[2]), min(a.bbox[3], b.bbox[3])
+    if y0 >= y1 or x0 >= x1:
+        return 0.0
+    ca = a.crop[y0 - a.bbox[0]:y1 - a.bbox[0], x0 - a.bbox[2]:x1 - a.bbox[2]]
+    cb = b.crop[y0 - b.bbox[0]:y1 - b.bbox[0], x0 - b.bbox[2]:x1 - b.bbox[2]]
+    inter = int(np.count_nonzero(ca & cb))
+    union = a.area + b.area - inter
+    return inter / union if union else 0.0
+
+
+def check_entries(image_path: str, entries: List[SegmentationEntry], tiny_area: int = 16,
+                  overlap_iou: float = 0.0, duplicate_iou: float = 0.9) -> Tuple[List[QAIssue], int]:
+    """
+    QA jednoho obrázku. Vrací (issues, počet kandidátních párů).
+    Dekódované masky importovaných záznamů se po kontrole zase uvolní.
+    """
+    issues = []
+    compact = []
+    for entry in entries:
+        was_decoded = entry.mask is not None
+        compact.append(CompactMask.from_mask(entry.get_mask()))
+        if not was_decoded:
+            entry.release_mask()
+    valid = []
+    for entry, cm in zip(entries, compact):
+        if cm.area == 0:
+            issues.append(QAIssue(ISSUE_EMPTY, image_path, (entry.id,), 0))
+            continue
+        if cm.area < tiny_area:
+            issues.append(QAIssue(ISSUE_TINY, image_path, (entry.id,), cm.area))
+        valid.append((entry, cm))
+    if len(valid) < 2:
+        return issues, 0
+    boxes = np.array([cm.bbox for _, cm in valid], dtype=np.int64)
+    pairs = candidate_pairs(boxes)
+    for i, j in pairs:
+        (ea, ca), (eb, cb) = valid[i], valid[j]
+        iou = mask_iou(ca, cb)
+        if iou <= overlap_iou:
+            continue
+        kind = ISSUE_DUPLICATE if iou >= duplicate_iou else ISSUE_OVERLAP
+        ids = tuple(sorted((ea.id, eb.id)))
+        issues.append(QAIssue(kind, image_path, ids, iou, ea.label == eb.label))
+    return issues, len(pairs)
+
+
+def run_qa(storage: SegmentationStorage, image_paths: Optional[Iterable[str]] = None, tiny_area: int = 16,
+           overlap_iou: float = 0.0, duplicate_iou: float = 0.9) -> QAReport:
+    """
+    Kontrola kvality anotací: prázdné a malé masky, překryvy a téměř duplicitní
+    anotace (IoU >= duplicate_iou). Páry se hledají sweepem přes bboxy, IoU se
+    počítá přesně jen z oříznutých masek kandidátů.
+    """
+    report = QAReport()
+    all_segs = storage.get_all_segmentations()
+    paths = list(image_paths) if image_paths is not None else list(all_segs.keys())
+    for path in paths:
+        entries = storage.get_segmentations(path)
+        issues, pairs = check_entries(path, entries, tiny_area, overlap_iou, duplicate_iou)
+        report.issues.extend(issues)
+        report.candidate_pairs += pairs
+        report.checked_images += 1
+        report.checked_annotations += len(entries)
+    return report
+
+
+def format_report(report: QAReport) -> str:
+    names = {ISSUE_EMPTY: 'prázdná maska', ISSUE_TINY: 'malá maska',
+             ISSUE_OVERLAP: 'překryv', ISSUE_DUPLICATE: 'téměř duplicita'}
+    counts = report.summary()
+    lines = [f"Obrázků: {report.checked_images}, anotací: {report.checked_annotations}, "
+             f"kandidátních párů: {report.candidate_pairs}",
+             ', '.join(f"{names[k]}: {v}" for k, v in counts.items()), '']
+    for path, issues in report.by_image().items():
+        lines.append(path)
+        for issue in issues:
+            ids = ', '.join(str(i) for i in issue.ids)
+            if issue.kind in (ISSUE_OVERLAP, ISSUE_DUPLICATE):
+                same = ', stejný label' if issue.same_label else ''
+                lines.append(f"  {names[issue.kind]}: id {ids} (IoU {issue.value:.3f}{same})")
+            else:
+                lines.append(f"  {names[issue.kind]}: id {ids} (plocha {int(issue.value)} px)")
+    return '\n'.join(lines)
@@ -0,0 +1,190 @@
+import sys
+import json
+import zlib
+import argparse
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from annotation_engine import AnnotationSession, build_coco_json, load_rgb_image, DEFAULT_SEGMENTS
+from coco_io import PolygonExportSettings
+from superpixel_backends import DEFAULT_BACKEND
+
+# Lokální HTTP/JSON služba nad annotation_engine. Každý obrázek patří vždy stejnému
+# workeru (proces s jedním vláknem), takže jeho session cache se sdílí mezi požadavky.
+#
+#   POST /segment    {"image_path", "backend"?, "n_segments"?}   -> {"components", "width", "height"}
+#   POST /component  {"image_path", "x", "y"}                    -> {"component"}
+#   POST /commit     {"image_path", "components": [...], "label", "tolerance"?, "max_vertices"?}
+#                                                                 -> {"annotation"}
+#   POST /export     {"image_path"?}                             -> COCO JSON (všechny obrázky bez image_path)
+
+DEFAULT_PORT = 8765
+# Kolik obrázků drží worker načtených (obrázek + labely); anotace zůstávají vždy
+MAX_LOADED_SESSIONS = 8
+
+# --- Stav workeru (žije v procesu workeru) ---
+_sessions: Dict[str, AnnotationSession] = {}
+_segment_params: Dict[str, dict] = {}
+_loaded: 'OrderedDict[str, None]' = OrderedDict()
+
+
+def _release(path: str):
+    session = _sessions[path]
+    session.image = None
+    session.superpixel_labels = None
+    session.component_labels = None
+    session.component_slices = []
+
+
+def _get_session(path: str, segmented: bool = True) -> AnnotationSession:
+    session = _sessions.get(path)
+    if session is None:
+        session = _sessions[path] = AnnotationSession.from_file(path)
+    elif session.image is None:
+        # Uvolněná session: obrázek i superpixely se obnoví se stejnými parametry (SLIC je deterministický)
+        session.image = load_rgb_image(path)
+        if path in _segment_params:
+            session.segment(**_segment_params[path])
+    _loaded[path] = None
+    _loaded.move_to_end(path)
+    while len(_loaded) > MAX_LOADED_SESSIONS:
+        old, _ = _loaded.popitem(last=False)
+        _release(old)
+    if segmented and session.component_labels is None:
+        raise ValueError(f"Obrázek {path} ještě není segmentovaný, zavolejte /segment")
+    return session
+
+
+def _export_records(image_path: Optional[str]) -> List[dict]:
+    paths = [image_path] if image_path is not None else list(_sessions.keys())
+    records = []
+    for path in paths:
+        session = _sessions.get(path)
+        if session is None or not session.annotations:
+            continue
+        # image_record potřebuje jen uložený rozměr - uvolněná session se nenačítá
+        records.append(dict(session.image_record(), image_path=path))
+    return records
+
+
+def worker_call(op: str, params: dict):
+    # Vstupní bod workeru - musí být na úrovni modulu kvůli pickle
+    path = params.get('image_path')
+    if op == 'segment':
+        segment_params = {'backend': params.get('backend', DEFAULT_BACKEND),
+                          'n_segments': int(params.get('n_segments', DEFAULT_SEGMENTS))}
+        session = _get_session(path, segmented=False)
+        n = session.segment(**segment_params)
+        _segment_params[path] = segment_params
+        h, w = session.shape
+        return {'components': n, 'width': w, 'height': h}
+    if op == 'component':
+        return {'component': _get_session(path).component_at(int(params['x']), int(params['y']))}
+    if op == 'commit':
+        settings = PolygonExportSettings(tolerance=float(params.get('tolerance', 1.0)),
+                                         max_vertices=params.get('max_vertices') or None)
+        ann = _get_session(path).commit(params.get('components', []), params.get('label', ''), settings)
+        return {'annotation': ann}
+    if op == 'export':
+        return _export_records(path)
+    raise ValueError(f"Neznámá operace: {op}")
+
+
+class AnnotationService:
+    """
+    Směrovač požadavků: každý worker je samostatný proces (ProcessPoolExecutor s jedním
+    procesem), obrázek se podle crc32 cesty posílá vždy stejnému workeru.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = [ProcessPoolExecutor(max_workers=1) for _ in range(max(workers, 1))]
+
+    def _worker_for(self, image_path: str) -> ProcessPoolExecutor:
+        return self.workers[zlib.crc32(image_path.encode('utf-8')) % len(self.workers)]
+
+    def call(self, op: str, params: dict):
+        if op == 'export':
+            return self.export(params.get('image_path'))
+        if not params.get('image_path'):
+            raise ValueError("Chybí 'image_path'")
+        return self._worker_for(params['image_path']).submit(worker_call, op, params).result()
+
+    def export(self, image_path: Optional[str] = None) -> dict:
+        if image_path is not None:
+            records = self._worker_for(image_path).submit(worker_call, 'export', {'image_path': image_path}).result()
+        else:
+            futures = [w.submit(worker_call, 'export', {}) for w in self.workers]
+            records = [r for f in futures for r in f.result()]
+        # Id anotací jsou unikátní jen v rámci session - pro export se přečíslují
+        next_id = 1
+        for record in records:
+            renumbered = []
+            for ann in record['annotations']:
+                renumbered.append(dict(ann, id=next_id))
+                next_id += 1
+            record['annotations'] = renumbered
+        return build_coco_json(records)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    ROUTES = {'/segment': 'segment', '/component': 'component', '/commit': 'commit', '/export': 'export'}
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        op = self.ROUTES.get(self.path.split('?')[0])
+        if op is None:
+            self._send_json(404, {'error': f"Neznámý endpoint: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+            result = self.server.service.call(op, params)
+        except (ValueError, KeyError, TypeError, FileNotFoundError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            print(f"Chyba při zpracování {self.path}:")
+            traceback.print_exc()
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, result)
+
+
+def create_server(host: str = '127.0.0.1', port: int = DEFAULT_PORT, workers: int = 2) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.service = AnnotationService(workers)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Lokální HTTP/JSON služba pro superpixelovou anotaci')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args(argv)
+    server = create_server(args.host, args.port, args.workers)
+    print(f"Služba běží na http://{args.host}:{server.server_address[1]} ({args.workers} workerů)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import os
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
+import numpy as np
+from skimage import measure
+from skimage.draw import polygon as skpolygon
+from segmentation_storage import SegmentationStorage, SegmentationEntry
+from selection_tools import fill_polygon
+
+try:
+    # Volitelné: s ijson se soubor čte proudově a celý JSON nikdy není v paměti
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def rle_string_to_counts(s: str) -> list:
+    """
+    Dekóduje komprimovaný COCO RLE řetězec (formát pycocotools) na seznam délek běhů.
+    """
+    counts = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def rle_to_mask(rle: dict) -> np.ndarray:
+    h, w = rle['size']
+    counts = rle['counts']
+    if isinstance(counts, (bytes, str)):
+        counts = rle_string_to_counts(counts.decode('ascii') if isinstance(counts, bytes) else counts)
+    counts = np.asarray(counts, dtype=np.int64)
+    # Běhy se střídají 0/1 (začíná se nulami), pixely jsou po sloupcích
+    values = (np.arange(len(counts)) % 2).astype(np.uint8)
+    flat = np.repeat(values, counts)
+    flat = np.pad(flat, (0, max(h * w - len(flat), 0)))[:h * w]
+    return flat.reshape((w, h)).T.copy()
+
+
+def polygons_to_mask(polygons: list, height: int, width: int) -> np.ndarray:
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for seg in polygons:
+        if len(seg) >= 6:
+            rr, cc = skpolygon(seg[1::2], seg[0::2], shape=mask.shape)
+            mask[rr, cc] = 1
+    return mask
+
+
+def decode_segmentation(segmentation, height: int, width: int) -> np.ndarray:
+    """
+    Převede COCO 'segmentation' (seznam polygonů nebo RLE) na uint8 masku height x width.
+    """
+    if isinstance(segmentation, dict):
+        return rle_to_mask(segmentation)
+    return polygons_to_mask(segmentation, height, width)
+
+
+@dataclass
+class PolygonExportSettings:
+    tolerance: float = 1.0  # Douglas-Peucker tolerance v pixelech, 0 = bez zjednodušení
+    max_vertices: Optional[int] = None  # limit vrcholů na polygon (tolerance se zvyšuje)
+    min_iou: float = 0.95  # minimální IoU zjednodušených polygonů vůči masce
+    round_coords: bool = False  # celočíselné souřadnice
+
+
+def simplify_polygon(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker nad polem bodů (N, 2); vzdálenosti se v každém úseku počítají vektorově.
+    """
+    n = len(points)
+    if tolerance <= 0 or n < 4:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        inner = points[i + 1:j]
+        a = points[i]
+        d = points[j] - a
+        length = np.hypot(d[0], d[1])
+        rel = inner - a
+        if length == 0:
+            # Uzavřený obrys: první a poslední bod splývají
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(d[0] * rel[:, 1] - d[1] * rel[:, 0]) / length
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            split = i + 1 + k
+            keep[split] = True
+            stack.append((i, split))
+            stack.append((split, j))
+    return points[keep]
+
+
+def _ring_to_coco(points: np.ndarray, round_coords: bool) -> List:
+    if np.allclose(points[0], points[-1]):
+        points = points[:-1]
+    if round_coords:
+        points = np.round(points).astype(np.int64)
+        # Po zaokrouhlení odstraň po sobě jdoucí duplicity
+        if len(points) > 1:
+            points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+    if len(points) < 3:
+        return []
+    return points.ravel().tolist()
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+def _simplify_rings(rings, tolerance, round_coords):
+    return [p for p in (_ring_to_coco(simplify_polygon(r, tolerance), round_coords) for r in rings) if len(p) >= 6]
+
+
+def mask_to_polygons(mask: np.ndarray, settings: Optional[PolygonExportSettings] = None) -> List[List]:
+    """
+    Převede masku na COCO polygony [x1, y1, x2, y2, ...] se zjednodušením dle settings.
+    Pokud zjednodušení sníží IoU vůči masce pod settings.min_iou (nebo pod IoU
+    nezjednodušených obrysů, je-li nižší), tolerance se postupně půlí.
+    """
+    settings = settings or PolygonExportSettings()
+    mask = np.asarray(mask) > 0
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return []
+    cols = np.flatnonzero(mask.any(axis=0))
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    crop = mask[y0:y1, x0:x1]
+    h, w = mask.shape
+    # Obrysy jen ve výřezu; okraj 1 px uzavře i obrysy na hraně obrázku
+    rings = []
+    for contour in measure.find_contours(np.pad(crop, 1).astype(np.uint8), 0.5):
+        xy = contour[:, ::-1] + (x0 - 1, y0 - 1)
+        rings.append(np.clip(xy, 0, (w - 1, h - 1)))
+
+    def rasterize(polys):
+        # Sjednocení polygonů jako v pycocotools
+        out = np.zeros(crop.shape, dtype=bool)
+        for p in polys:
+            out |= fill_polygon(np.asarray(p[0::2]) - x0, np.asarray(p[1::2]) - y0, crop.shape)
+        return out
+
+    def within_budget(polys):
+        return not settings.max_vertices or all(len(p) // 2 <= settings.max_vertices for p in polys)
+
+    tolerance = settings.tolerance
+    if settings.max_vertices:
+        # Zvyšuj toleranci, dokud se největší polygon nevejde do limitu vrcholů
+        tolerance = max(tolerance, 0.25)
+        for _ in range(16):
+            if within_budget(_simplify_rings(rings, tolerance, settings.round_coords)):
+                break
+            tolerance *= 2
+    exact = _simplify_rings(rings, 0, settings.round_coords)
+    if tolerance <= 0:
+        return exact
+    required = min(settings.min_iou, _iou(rasterize(exact), crop))
+    best = None
+    for _ in range(6):
+        polys = _simplify_rings(rings, tolerance, settings.round_coords)
+        if not within_budget(polys):
+            break  # limit vrcholů má přednost před IoU
+        best = polys
+        if _iou(rasterize(polys), crop) >= required - 1e-9:
+            return polys
+        tolerance /= 2
+    return best if best is not None else exact
+
+
+SECTIONS = ('images', 'categories', 'annotations')
+
+
+def _iter_sections(path: str) -> Iterator[Tuple[str, Optional[dict]]]:
+    """
+    Jeden průchod souborem: položky sekcí images/categories/annotations v pořadí, v jakém
+    jsou v souboru, a po konci každé sekce (section, None).
+    """
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            builder = None
+            section = None
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if event == 'end_map' and prefix == f'{section}.item':
+                        yield section, builder.value
+                        builder = None
+                elif event == 'start_map' and prefix.endswith('.item') and prefix[:-5] in SECTIONS:
+                    section = prefix[:-5]
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                elif event == 'end_array' and prefix in SECTIONS:
+                    yield prefix, None
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        coco = json.load(f)
+    for section in SECTIONS:
+        for item in coco.get(section, []):
+            yield section, item
+        yield section, None
+
+
+def import_coco_json(path: str, storage: SegmentationStorage, image_root: Optional[str] = None) -> Dict[str, int]:
+    """
+    Načte COCO JSON do storage. Masky zůstávají zakódované (polygony/RLE) a dekódují
+    se až přes SegmentationEntry.get_mask(), tj. při otevření obrázku.
+    image_root: adresář s obrázky, výchozí je adresář JSON souboru.
+    Vrací statistiku {'images': n, 'annotations': n, 'skipped': n, 'max_id': id}.
+    """
+    if image_root is None:
+        image_root = os.path.dirname(os.path.abspath(path))
+    images = {}  # {image_id: (path, height, width)}
+    categories = {}
+    stats = {'images': 0, 'annotations': 0, 'skipped': 0, 'max_id': 0}
+    # Anotace před koncem sekcí images a categories počkají, ostatní jdou rovnou do storage
+    pending = []
+    finished = set()
+
+    def add_annotation(item):
+        image = images.get(item.get('image_id'))
+        if image is None and 'image_id' not in item and len(images) == 1:
+            # Export z této aplikace nemá image_id, obsahuje ale jen jeden obrázek
+            image = next(iter(images.values()))
+        segmentation = item.get('segmentation')
+        if image is None or not segmentation:
+            stats['skipped'] += 1
+            return
+        image_path, height, width = image
+        if isinstance(segmentation, dict):
+            height, width = segmentation['size']
+        label = item.get('label') or categories.get(item.get('category_id'), 'object')
+        storage.add_segmentation(SegmentationEntry(
+            id=int(item['id']),
+            image_path=image_path,
+            label=label,
+            mask=None,
+            encoded={'segmentation': segmentation, 'height': height, 'width': width,
+                     'bbox': item.get('bbox'), 'area': item.get('area'), 'iscrowd': item.get('iscrowd', 0)}
+        ))
+        stats['annotations'] += 1
+        stats['max_id'] = max(stats['max_id'], int(item['id']))
+
+    for section, item in _iter_sections(path):
+        if item is None:
+            finished.add(section)
+            if {'images', 'categories'} <= finished:
+                for ann in pending:
+                    add_annotation(ann)
+                pending = []
+        elif section == 'images':
+            images[item['id']] = (os.path.join(image_root, item['file_name']),
+                                  int(item.get('height', 0)), int(item.get('width', 0)))
+            stats['images'] += 1
+        elif section == 'categories':
+            categories[item['id']] = item.get('name', str(item['id']))
+        elif {'images', 'categories'} <= finished:
+            add_annotation(item)
+        else:
+            pending.append(item)
+    # Soubor bez některé ze sekcí
+    for ann in pending:
+        add_annotation(ann)
+    return stats
@@ -0,0 +1,94 @@
+import numpy as np
+
+# Podporované přípony obrázků - pro dialogy i procházení snímků ve složce
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+IMAGE_FILE_FILTER = 'Obrázky (' + ' '.join('*' + ext for ext in IMAGE_EXTENSIONS) + ')'
+
+# Výchozí okno pro obrázky s vyšší bitovou hloubkou (percentily histogramu)
+DEFAULT_LOW_PERCENTILE = 0.5
+DEFAULT_HIGH_PERCENTILE = 99.5
+
+
+def to_index_image(image: np.ndarray) -> np.ndarray:
+    """
+    Jednorázová normalizace při načtení na uint8/uint16, aby šlo zobrazení řídit
+    lookup tabulkou: uint8 a uint16 zůstávají, int8/int16 se posunou o offset,
+    ostatní typy (float, int32, ...) se lineárně přeškálují z rozsahu dat na uint16.
+    Alfa kanál se zahodí.
+    """
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[..., :3]
+    if image.dtype in (np.uint8, np.uint16):
+        return image
+    if image.dtype == np.int8:
+        return (image.astype(np.int16) + 128).astype(np.uint8)
+    if image.dtype == np.int16:
+        return (image.astype(np.int32) + 32768).astype(np.uint16)
+    data = image.astype(np.float64)
+    finite = np.isfinite(data)
+    lo = float(data[finite].min()) if finite.any() else 0.0
+    hi = float(data[finite].max()) if finite.any() else 1.0
+    scaled = (np.where(finite, data, lo) - lo) / max(hi - lo, 1e-12) * 65535
+    return np.round(scaled).astype(np.uint16)
+
+
+class DisplayLUT:
+    """
+    Zobrazení obrázku s libovolnou bitovou hloubkou přes lookup tabulku.
+    Histogram se spočítá jednou při načtení; změna okna (percentily + gama) přepočítá
+    jen tabulku o 256/65536 položkách a obraz se z ní vezme jedním np.take.
+    """
+
+    def __init__(self, index_image: np.ndarray, low_percentile: float = None,
+                 high_percentile: float = None, gamma: float = 1.0):
+        self.levels = 256 if index_image.dtype == np.uint8 else 65536
+        self.high_bit_depth = index_image.dtype != np.uint8
+        histogram = np.bincount(index_image.ravel(), minlength=self.levels)
+        self.cdf = np.cumsum(histogram) / max(int(histogram.sum()), 1)
+        if low_percentile is None:
+            low_percentile = DEFAULT_LOW_PERCENTILE if self.high_bit_depth else 0.0
+        if high_percentile is None:
+            high_percentile = DEFAULT_HIGH_PERCENTILE if self.high_bit_depth else 100.0
+        self.lut = None
+        self.window = (0, self.levels - 1)
+        self.set_window(low_percentile, high_percentile, gamma)
+
+    def percentile_level(self, percentile: float) -> int:
+        # Nejnižší hodnota, pod kterou (včetně) leží daný podíl pixelů
+        if percentile <= 0:
+            return int(np.argmax(self.cdf > 0))
+        if percentile >= 100:
+            return int(np.searchsorted(self.cdf, self.cdf[-1] - 1e-12))
+        return int(np.searchsorted(self.cdf, percentile / 100.0))
+
+    def set_window(self, low_percentile: float, high_percentile: float, gamma: float = 1.0):
+        # U 8bitových obrázků znamená 0 % / 100 % celý rozsah typu (0, 255), ne min/max dat -
+        # výchozí okno je identita a běžné fotky se při načtení neroztahují
+        full_low = not self.high_bit_depth and low_percentile <= 0
+        full_high = not self.high_bit_depth and high_percentile >= 100
+        lo = 0 if full_low else self.percentile_level(low_percentile)
+        hi = max(self.levels - 1 if full_high else self.percentile_level(high_percentile), lo + 1)
+        self.window = (lo, hi)
+        t = np.clip((np.arange(self.levels, dtype=np.float32) - lo) / (hi - lo), 0.0, 1.0)
+        if gamma != 1.0:
+            t = t ** (1.0 / gamma)
+        self.lut = np.round(t * 255).astype(np.uint8)
+
+    def is_identity(self) -> bool:
+        return self.levels == 256 and np.array_equal(self.lut, np.arange(256, dtype=np.uint8))
+
+    def apply(self, index_image: np.ndarray) -> np.ndarray:
+        # uint8 obraz pro overlay a zobrazení
+        if self.is_identity():
+            return index_image
+        return np.take(self.lut, index_image)
+
+    def float_image(self, index_image: np.ndarray) -> np.ndarray:
+        """
+        float32 obraz v [0, 1] pro segmentaci a příznaky, roztažený na výchozí okno.
+        Nezávisí na interaktivním kontrastu, takže se počítá jednou při načtení.
+        """
+        lo = self.percentile_level(DEFAULT_LOW_PERCENTILE)
+        hi = max(self.percentile_level(DEFAULT_HIGH_PERCENTILE), lo + 1)
+        table = np.clip((np.arange(self.levels, dtype=np.float32) - lo) / (hi - lo), 0.0, 1.0)
+        return np.take(table, index_image)
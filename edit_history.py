@@ -0,0 +1,166 @@
+from typing import List, Optional, Tuple
+from dataclasses import dataclass, field
+import zlib
+import numpy as np
+
+# Výchozí paměťový limit historie (součet velikostí všech kroků undo + redo)
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024
+
+
+def pack_mask(mask: np.ndarray) -> bytes:
+    # Bool maska -> bity -> zlib; řídké a souvislé rozdíly se zmenší o řády
+    return zlib.compress(np.packbits(mask, axis=None).tobytes(), 1)
+
+
+def unpack_mask(data: bytes, shape: Tuple[int, int]) -> np.ndarray:
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    count = shape[0] * shape[1]
+    return np.unpackbits(bits, count=count).reshape(shape).astype(bool)
+
+
+@dataclass
+class MaskDelta:
+    # XOR rozdíl bool masky ve výřezu bbox (y0, y1, x0, x1); undo i redo je stejná operace
+    bbox: Tuple[int, int, int, int]
+    data: bytes
+
+    @classmethod
+    def from_crops(cls, before: np.ndarray, after: np.ndarray, bbox) -> Optional['MaskDelta']:
+        diff = before ^ after
+        if not diff.any():
+            return None
+        return cls(tuple(int(v) for v in bbox), pack_mask(diff))
+
+    def apply(self, mask: np.ndarray):
+        y0, y1, x0, x1 = self.bbox
+        mask[y0:y1, x0:x1] ^= unpack_mask(self.data, (y1 - y0, x1 - x0))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data) + 64
+
+
+@dataclass
+class SelectionChange:
+    delta: Optional[MaskDelta]
+    components_before: frozenset = frozenset()
+    components_after: frozenset = frozenset()
+
+    @property
+    def nbytes(self) -> int:
+        size = self.delta.nbytes if self.delta is not None else 0
+        return size + 8 * (len(self.components_before) + len(self.components_after)) + 64
+
+
+@dataclass
+class BorderChange:
+    action: str  # 'add' / 'remove'
+    index: int
+    path: List[Tuple[int, int]]
+
+    @property
+    def nbytes(self) -> int:
+        return 16 * len(self.path) + 64
+
+
+@dataclass
+class SegmentationChange:
+    action: str  # 'add' / 'remove'
+    annotation: dict  # COCO anotace z hlavního okna
+    image_path: Optional[str] = None
+    mask_shape: Optional[Tuple[int, int]] = None
+    mask_bbox: Optional[Tuple[int, int, int, int]] = None
+    mask_data: Optional[bytes] = None  # maska záznamu ve storage, oříznutá na bbox
+
+    @classmethod
+    def create(cls, action, annotation, image_path=None, mask=None) -> 'SegmentationChange':
+        change = cls(action, dict(annotation), image_path)
+        if mask is not None:
+            mask = np.asarray(mask) > 0
+            change.mask_shape = mask.shape
+            rows = np.flatnonzero(mask.any(axis=1))
+            if len(rows):
+                cols = np.flatnonzero(mask.any(axis=0))
+                y0, y1, x0, x1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+                change.mask_bbox = (y0, y1, x0, x1)
+                change.mask_data = pack_mask(mask[y0:y1, x0:x1])
+        return change
+
+    def mask(self) -> Optional[np.ndarray]:
+        if self.mask_shape is None:
+            return None
+        mask = np.zeros(self.mask_shape, dtype=np.uint8)
+        if self.mask_bbox is not None:
+            y0, y1, x0, x1 = self.mask_bbox
+            mask[y0:y1, x0:x1] = unpack_mask(self.mask_data, (y1 - y0, x1 - x0))
+        return mask
+
+    @property
+    def nbytes(self) -> int:
+        polygon_values = sum(len(p) for p in self.annotation.get('segmentation', []))
+        return 8 * polygon_values + len(self.mask_data or b'') + 256
+
+
+@dataclass
+class HistoryStep:
+    # Jeden krok undo/redo = seznam změn, vrací se v obráceném pořadí
+    changes: list = field(default_factory=list)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self.changes)
+
+
+class EditHistory:
+    """
+    Zásobníky undo/redo s kompaktními delta kroky.
+    Celková velikost kroků je omezena budget_bytes, nejstarší kroky se zahazují.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_HISTORY_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.undo_stack: List[HistoryStep] = []
+        self.redo_stack: List[HistoryStep] = []
+        self.nbytes = 0
+
+    def push(self, changes: list):
+        changes = [c for c in changes if c is not None]
+        if not changes:
+            return
+        step = HistoryStep(changes)
+        self.undo_stack.append(step)
+        self.nbytes += step.nbytes
+        for old in self.redo_stack:
+            self.nbytes -= old.nbytes
+        self.redo_stack.clear()
+        self._enforce_budget()
+
+    def undo(self) -> Optional[HistoryStep]:
+        if not self.undo_stack:
+            return None
+        step = self.undo_stack.pop()
+        self.redo_stack.append(step)
+        return step
+
+    def redo(self) -> Optional[HistoryStep]:
+        if not self.redo_stack:
+            return None
+        step = self.redo_stack.pop()
+        self.undo_stack.append(step)
+        return step
+
+    def can_undo(self) -> bool:
+        return bool(self.undo_stack)
+
+    def can_redo(self) -> bool:
+        return bool(self.redo_stack)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+
+    def _enforce_budget(self):
+        # Poslední krok se drží vždy, i když je sám větší než limit
+        while self.nbytes > self.budget_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.pop(0).nbytes
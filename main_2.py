@@ -1,28 +1,68 @@
+import os
 import sys
 import numpy as np
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
-    QFileDialog, QSlider, QFrame, QColorDialog, QScrollArea, QLineEdit, QCheckBox, QTextEdit, QDialog, QVBoxLayout as QVLayout, QDialogButtonBox, QHBoxLayout as QHLayout, QSpinBox
+    QFileDialog, QSlider, QFrame, QColorDialog, QScrollArea, QLineEdit, QCheckBox, QTextEdit, QDialog, QVBoxLayout as QVLayout, QDialogButtonBox, QHBoxLayout as QHLayout, QSpinBox, QComboBox, QDoubleSpinBox
 )
-from PyQt5.QtGui import QPixmap, QImage, QColor
+from PyQt5.QtGui import QPixmap, QImage, QColor, QKeySequence
 from PyQt5.QtCore import Qt
-from skimage import io, color, segmentation, img_as_ubyte, draw
-from scipy.ndimage import label as ndi_label
 import json
-from segmentation_storage import SegmentationStorage, SegmentationEntry
-from visualization_window import VisualizationWindow
+import threading
+import traceback
+from segmentation_storage import SegmentationStorage, SegmentationEntry, EVENT_REMOVED, EVENT_UPDATED
+from selection_tools import stroke_mask, polygon_region, box_region, covered_components
+from display_lut import IMAGE_EXTENSIONS, IMAGE_FILE_FILTER
+from superpixel_backends import available_backends, get_backend, DEFAULT_BACKEND
+from edit_history import EditHistory, SelectionChange, BorderChange, SegmentationChange, MaskDelta
+
+# skimage, scipy a moduly nad nimi se importují až při prvním použití (viz warm_up_imports),
+# aby se okno zobrazilo hned po spuštění
+HEAVY_MODULES = (
+    'skimage.io', 'skimage.color', 'skimage.segmentation', 'skimage.draw', 'skimage.measure',
+    'scipy.ndimage', 'coco_io', 'annotation_engine', 'region_features', 'sequence_tracking', 'visualization_window',
+)
+
+
+def warm_up_imports(modules=HEAVY_MODULES):
+    # Běží ve vlákně na pozadí; import lock zajistí, že souběžný import z GUI jen počká
+    import importlib
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            print(f"Modul '{name}' se nepodařilo předem načíst:")
+            traceback.print_exc()
 
 class SuperpixelAnnotator(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('Superpixel Segmentační annotátor (PyQt5)')
         self.setGeometry(100, 100, 1200, 800)
-        self.image = None
+        self.image = None  # uint8 RGB pro zobrazení a overlay (raw_image prohnaný display_lut)
+        self.raw_image = None  # načtený obrázek jako uint8/uint16 (viz display_lut.to_index_image)
+        self.display_lut = None  # DisplayLUT - okno/kontrast se mění jen v tabulce
+        self.segment_image = None  # obraz pro superpixely a příznaky (float32 u vyšší bitové hloubky)
         self.superpixel_edges = None
         self.manual_borders = []  # seznam ručně dokreslených hranic (každá je seznam bodů)
         self.current_border = []
         self.component_labels = None  # maska komponent
         self.selected_components = set()  # multi-select
+        self.selection_mask = None  # pixelová maska výběru (komponenty + úpravy štětcem)
+        self.component_slices = []  # bboxy komponent z find_objects, index = id - 1
+        self.component_sizes = None  # bincount label mapy, pro pokrytí při výběru lasem/obdélníkem
+        self.overlay = None  # cache vykresleného overlaye, mění se po oblastech
+        self.border_draw_mask = None  # pixely kreslené červeně (hranice superpixelů + ruční čáry)
+        self.superpixel_labels = None  # labely superpixelů bez ručních hranic
+        self.similarity_index = None  # SimilarityIndex nad aktuálními komponentami, staví se líně
+        self.brush_mode = None  # None / 'brush' / 'eraser'
+        self.brush_last_point = None
+        self.stroke_before = None  # kopie výběru na začátku tahu štětcem (pro undo)
+        self.stroke_bbox = None
+        self.region_mode = None  # None / 'box' / 'lasso'
+        self.region_points = []  # rohy obdélníku nebo body lasa v souřadnicích obrázku
+        self.history = EditHistory()  # undo/redo, limit paměti viz EditHistory.budget_bytes
+        self.history_replaying = False
         self.highlight_color = QColor(0, 255, 0, 120)
         self.manual_mode = False
         self.label_edit = None
@@ -33,6 +73,10 @@ class SuperpixelAnnotator(QMainWindow):
         self.label_buttons_widget = None
         self.label_buttons_layout = None
         self.seg_storage = SegmentationStorage()
+        self.seg_storage.subscribe(self.on_storage_event)
+        self.seg_rows = {}  # {ann_id: (row_widget, label)} řádky panelu segmentací
+        self.seg_image_paths = {}  # {ann_id: image_path} pro mazání ve storage
+        self.next_annotation_id = 1
         self.vis_window = None
         self.init_ui()
 
@@ -68,20 +112,102 @@ class SuperpixelAnnotator(QMainWindow):
         self.slic_spin.setValue(100)
         self.slic_spin.valueChanged.connect(self.slic_slider.setValue)
         self.slic_slider.valueChanged.connect(self.slic_spin.setValue)
+        # Volba algoritmu over-segmentace (viz superpixel_backends)
+        self.backend_combo = QComboBox()
+        for backend in available_backends():
+            self.backend_combo.addItem(backend.title, backend.name)
+            self.backend_combo.setItemData(self.backend_combo.count() - 1, backend.describe(), Qt.ToolTipRole)
+        self.backend_combo.setCurrentIndex(self.backend_combo.findData(DEFAULT_BACKEND))
+        self.backend_combo.currentIndexChanged.connect(self.update_superpixels)
         slic_layout = QHBoxLayout()
         slic_layout.addWidget(self.slic_label)
         slic_layout.addWidget(self.slic_slider)
         slic_layout.addWidget(self.slic_spin)
+        slic_layout.addWidget(self.backend_combo)
 
         # Barva zvýraznění
         self.color_btn = QPushButton('Barva zvýraznění')
         self.color_btn.setStyleSheet(f'background-color: {self.highlight_color.name()};')
         self.color_btn.clicked.connect(self.choose_color)
 
+        # Kontrast zobrazení (okno v percentilech histogramu + gama), mění jen lookup tabulku
+        self.contrast_low_spin = QDoubleSpinBox()
+        self.contrast_low_spin.setRange(0.0, 50.0)
+        self.contrast_low_spin.setSingleStep(0.5)
+        self.contrast_high_spin = QDoubleSpinBox()
+        self.contrast_high_spin.setRange(50.0, 100.0)
+        self.contrast_high_spin.setSingleStep(0.5)
+        self.contrast_high_spin.setValue(100.0)
+        self.gamma_spin = QDoubleSpinBox()
+        self.gamma_spin.setRange(0.1, 5.0)
+        self.gamma_spin.setSingleStep(0.1)
+        self.gamma_spin.setValue(1.0)
+        for spin in (self.contrast_low_spin, self.contrast_high_spin, self.gamma_spin):
+            spin.valueChanged.connect(self.update_contrast)
+        contrast_layout = QHBoxLayout()
+        contrast_layout.addWidget(QLabel('Kontrast min %:'))
+        contrast_layout.addWidget(self.contrast_low_spin)
+        contrast_layout.addWidget(QLabel('max %:'))
+        contrast_layout.addWidget(self.contrast_high_spin)
+        contrast_layout.addWidget(QLabel('Gama:'))
+        contrast_layout.addWidget(self.gamma_spin)
+
         # Režim ručního kreslení
         self.manual_checkbox = QCheckBox('Ruční dělení oblasti čárou (nebo klávesa C)')
         self.manual_checkbox.stateChanged.connect(self.toggle_manual_mode)
 
+        # Štětec a guma pro jemné úpravy výběru po pixelech
+        self.brush_checkbox = QCheckBox('Štětec (klávesa B)')
+        self.brush_checkbox.stateChanged.connect(lambda state: self.toggle_brush_mode('brush', state))
+        self.eraser_checkbox = QCheckBox('Guma (klávesa E)')
+        self.eraser_checkbox.stateChanged.connect(lambda state: self.toggle_brush_mode('eraser', state))
+        self.brush_spin = QSpinBox()
+        self.brush_spin.setMinimum(1)
+        self.brush_spin.setMaximum(100)
+        self.brush_spin.setValue(8)
+        brush_layout = QHBoxLayout()
+        brush_layout.addWidget(self.brush_checkbox)
+        brush_layout.addWidget(self.eraser_checkbox)
+        brush_layout.addWidget(QLabel('Poloměr:'))
+        brush_layout.addWidget(self.brush_spin)
+
+        # Výběr komponent obdélníkem nebo lasem podle pokrytí jejich plochy
+        self.box_checkbox = QCheckBox('Obdélník (klávesa R)')
+        self.box_checkbox.stateChanged.connect(lambda state: self.toggle_region_mode('box', state))
+        self.lasso_checkbox = QCheckBox('Laso (klávesa L)')
+        self.lasso_checkbox.stateChanged.connect(lambda state: self.toggle_region_mode('lasso', state))
+        self.coverage_spin = QDoubleSpinBox()
+        self.coverage_spin.setRange(0.05, 1.0)
+        self.coverage_spin.setSingleStep(0.05)
+        self.coverage_spin.setValue(0.5)
+        self.coverage_spin.setToolTip('Minimální podíl plochy oblasti uvnitř obdélníku/lasa')
+        region_layout = QHBoxLayout()
+        region_layout.addWidget(self.box_checkbox)
+        region_layout.addWidget(self.lasso_checkbox)
+        region_layout.addWidget(QLabel('Pokrytí:'))
+        region_layout.addWidget(self.coverage_spin)
+
+        # Výběr komponent podobných aktuálnímu výběru
+        self.similar_btn = QPushButton('Vybrat podobné (klávesa S)')
+        self.similar_btn.clicked.connect(self.select_similar)
+        self.similar_spin = QDoubleSpinBox()
+        self.similar_spin.setRange(0.1, 10.0)
+        self.similar_spin.setSingleStep(0.1)
+        self.similar_spin.setValue(1.5)
+        self.similar_spin.setToolTip('Maximální vzdálenost příznaků (barva, textura, histogram)')
+        similar_layout = QHBoxLayout()
+        similar_layout.addWidget(self.similar_btn)
+        similar_layout.addWidget(QLabel('Práh:'))
+        similar_layout.addWidget(self.similar_spin)
+
+        # Režim sekvence snímků: navazující superpixely a přenos anotací z předchozího snímku
+        self.sequence_checkbox = QCheckBox('Sekvence snímků (přenášet anotace)')
+        self.next_frame_btn = QPushButton('Další snímek (klávesa N)')
+        self.next_frame_btn.clicked.connect(self.open_next_frame)
+        sequence_layout = QHBoxLayout()
+        sequence_layout.addWidget(self.sequence_checkbox)
+        sequence_layout.addWidget(self.next_frame_btn)
+
         # Label pro vybrané oblasti
         self.label_edit = QLineEdit()
         self.label_edit.setPlaceholderText('Label pro vybrané oblasti')
@@ -111,10 +237,39 @@ class SuperpixelAnnotator(QMainWindow):
         self.show_json_btn.clicked.connect(self.show_coco_json)
         self.export_all_btn = QPushButton('Exportovat vše do COCO JSON')
         self.export_all_btn.clicked.connect(self.export_all_coco_json)
+        self.export_masks_btn = QPushButton('Exportovat masky (PNG + NPY)')
+        self.export_masks_btn.setToolTip('Indexované PNG masky instancí a tříd + shardy .npy pro trénink')
+        self.export_masks_btn.clicked.connect(self.export_training_masks)
+        # Zjednodušení polygonů při tvorbě COCO anotace
+        self.simplify_spin = QDoubleSpinBox()
+        self.simplify_spin.setRange(0.0, 20.0)
+        self.simplify_spin.setSingleStep(0.5)
+        self.simplify_spin.setValue(1.0)
+        self.simplify_spin.setToolTip('Tolerance zjednodušení polygonu v pixelech (0 = bez zjednodušení)')
+        self.max_vertices_spin = QSpinBox()
+        self.max_vertices_spin.setRange(0, 10000)
+        self.max_vertices_spin.setValue(0)
+        self.max_vertices_spin.setToolTip('Maximální počet vrcholů polygonu (0 = bez limitu)')
+        self.round_coords_checkbox = QCheckBox('Celá čísla')
+        export_layout = QHBoxLayout()
+        export_layout.addWidget(QLabel('Tolerance polygonu:'))
+        export_layout.addWidget(self.simplify_spin)
+        export_layout.addWidget(QLabel('Max. vrcholů:'))
+        export_layout.addWidget(self.max_vertices_spin)
+        export_layout.addWidget(self.round_coords_checkbox)
         self.new_label_btn = QPushButton('Nový label')
         self.new_label_btn.clicked.connect(self.new_label)
         self.visualize_btn = QPushButton('Vizualizace segmentací')
         self.visualize_btn.clicked.connect(self.open_visualization)
+        self.import_btn = QPushButton('Importovat COCO JSON')
+        self.import_btn.clicked.connect(self.import_coco_json)
+        self.undo_btn = QPushButton('Zpět (Ctrl+Z)')
+        self.undo_btn.clicked.connect(self.undo)
+        self.redo_btn = QPushButton('Znovu (Ctrl+Y)')
+        self.redo_btn.clicked.connect(self.redo)
+        undo_layout = QHBoxLayout()
+        undo_layout.addWidget(self.undo_btn)
+        undo_layout.addWidget(self.redo_btn)
 
         # Panel pro správu segmentací
         self.seg_panel = QWidget()
@@ -131,15 +286,24 @@ class SuperpixelAnnotator(QMainWindow):
         slider_layout = QVBoxLayout()
         slider_layout.addLayout(slic_layout)
         slider_layout.addWidget(load_btn)
+        slider_layout.addLayout(sequence_layout)
         slider_layout.addWidget(self.color_btn)
+        slider_layout.addLayout(contrast_layout)
         slider_layout.addWidget(self.manual_checkbox)
+        slider_layout.addLayout(brush_layout)
+        slider_layout.addLayout(region_layout)
+        slider_layout.addLayout(similar_layout)
         slider_layout.addWidget(self.label_edit)
         slider_layout.addWidget(self.label_buttons_widget)
+        slider_layout.addLayout(export_layout)
         slider_layout.addWidget(self.save_json_btn)
         slider_layout.addWidget(self.new_label_btn)
         slider_layout.addWidget(self.show_json_btn)
         slider_layout.addWidget(self.export_all_btn)
+        slider_layout.addWidget(self.export_masks_btn)
+        slider_layout.addWidget(self.import_btn)
         slider_layout.addWidget(self.visualize_btn)
+        slider_layout.addLayout(undo_layout)
 
         main_layout = QHBoxLayout()
         left_layout = QVBoxLayout()
@@ -156,39 +320,149 @@ class SuperpixelAnnotator(QMainWindow):
         if color.isValid():
             self.highlight_color = color
             self.color_btn.setStyleSheet(f'background-color: {self.highlight_color.name()};')
+            self.refresh_overlay_region()
             self.display_image()
 
     def toggle_manual_mode(self, state):
         self.manual_mode = bool(state)
         self.current_border = []
+        if self.manual_mode:
+            self.brush_checkbox.setChecked(False)
+            self.eraser_checkbox.setChecked(False)
+            self.box_checkbox.setChecked(False)
+            self.lasso_checkbox.setChecked(False)
+        self.display_image()
+
+    def toggle_brush_mode(self, mode, state):
+        if state:
+            self.brush_mode = mode
+            # Štětec, guma a ruční čára se navzájem vylučují
+            other = self.eraser_checkbox if mode == 'brush' else self.brush_checkbox
+            other.setChecked(False)
+            self.manual_checkbox.setChecked(False)
+            self.box_checkbox.setChecked(False)
+            self.lasso_checkbox.setChecked(False)
+        elif self.brush_mode == mode:
+            self.brush_mode = None
+        self.brush_last_point = None
+
+    def toggle_region_mode(self, mode, state):
+        if state:
+            self.region_mode = mode
+            other = self.lasso_checkbox if mode == 'box' else self.box_checkbox
+            other.setChecked(False)
+            self.brush_checkbox.setChecked(False)
+            self.eraser_checkbox.setChecked(False)
+            self.manual_checkbox.setChecked(False)
+        elif self.region_mode == mode:
+            self.region_mode = None
+        self.region_points = []
+        self.display_image()
+
+    def sync_contrast_controls(self):
+        # Výchozí okno nového obrázku do ovládání bez přepočtu (signály se zablokují)
+        from display_lut import DEFAULT_LOW_PERCENTILE, DEFAULT_HIGH_PERCENTILE
+        high = self.display_lut.high_bit_depth
+        values = ((self.contrast_low_spin, DEFAULT_LOW_PERCENTILE if high else 0.0),
+                  (self.contrast_high_spin, DEFAULT_HIGH_PERCENTILE if high else 100.0),
+                  (self.gamma_spin, 1.0))
+        for spin, value in values:
+            spin.blockSignals(True)
+            spin.setValue(value)
+            spin.blockSignals(False)
+
+    def update_contrast(self):
+        # Nová tabulka + jeden np.take; superpixely ani příznaky se nepřepočítávají
+        if self.raw_image is None or self.display_lut is None:
+            return
+        self.display_lut.set_window(self.contrast_low_spin.value(), self.contrast_high_spin.value(),
+                                    self.gamma_spin.value())
+        self.image = self.display_lut.apply(self.raw_image)
+        self.refresh_overlay_region()
         self.display_image()
 
     def set_label(self, text):
         self.current_label = text
 
     def load_image(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, 'Vyberte obrázek', '', 'Obrázky (*.png *.jpg *.jpeg *.bmp)')
+        file_name, _ = QFileDialog.getOpenFileName(self, 'Vyberte obrázek', '', IMAGE_FILE_FILTER)
         if file_name:
-            self.image = io.imread(file_name)
-            self.last_image_path = file_name
-            if self.image.ndim == 2:
-                self.image = color.gray2rgb(self.image)
-            self.manual_borders = []
-            self.current_border = []
-            self.selected_components = set()
-            self.current_label = ''
-            self.label_edit.setText('')
+            self.open_image(file_name)
+
+    def open_image(self, file_name):
+        # V režimu sekvence si pamatuj předchozí snímek pro warm start a přenos anotací
+        previous = None
+        if self.sequence_checkbox.isChecked() and self.image is not None and self.superpixel_labels is not None:
+            previous = (self.segment_image, self.superpixel_labels, self.last_image_path)
+        from annotation_engine import load_rgb_image
+        from display_lut import DisplayLUT, to_index_image
+        from sequence_tracking import frames_compatible, warm_start_superpixels
+        # Normalizace a histogram jen jednou při načtení, dál se mění jen lookup tabulka
+        self.raw_image = to_index_image(load_rgb_image(file_name))
+        self.display_lut = DisplayLUT(self.raw_image)
+        self.image = self.display_lut.apply(self.raw_image)
+        self.segment_image = self.display_lut.float_image(self.raw_image) if self.display_lut.high_bit_depth else self.raw_image
+        self.sync_contrast_controls()
+        self.last_image_path = file_name
+        self.manual_borders = []
+        self.current_border = []
+        self.selected_components = set()
+        self.selection_mask = None
+        self.history.clear()
+        self.current_label = ''
+        self.label_edit.setText('')
+        if previous is not None and frames_compatible(previous[0], self.segment_image):
+            self.apply_segments(warm_start_superpixels(self.segment_image, previous[1]))
+            self.propagate_annotations(*previous)
+        else:
             self.update_superpixels()
 
+    def open_next_frame(self):
+        from PyQt5.QtWidgets import QMessageBox
+        if self.last_image_path is None:
+            return
+        folder = os.path.dirname(self.last_image_path)
+        name = os.path.basename(self.last_image_path)
+        frames = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+        idx = frames.index(name) if name in frames else -1
+        if idx + 1 >= len(frames):
+            QMessageBox.information(self, 'Sekvence', 'Toto je poslední snímek ve složce.')
+            return
+        self.open_image(os.path.join(folder, frames[idx + 1]))
+
+    def propagate_annotations(self, prev_image, prev_labels, prev_path):
+        # Anotace předchozího snímku -> stejné superpixely v novém snímku, jako jeden krok historie
+        entries = self.seg_storage.get_segmentations(prev_path) if prev_path else []
+        if not entries or self.seg_storage.get_segmentations(self.last_image_path):
+            # Znovu otevřený snímek už anotace má - další přenos by je zdvojil
+            return
+        from sequence_tracking import propagate_masks
+        masks = propagate_masks(prev_labels, self.superpixel_labels, prev_image, self.segment_image,
+                                [e.get_mask() for e in entries])
+        changes = []
+        for entry, mask in zip(entries, masks):
+            if mask is not None:
+                coco_ann, new_entry = self.add_annotation(entry.label, mask)
+                changes.append(SegmentationChange.create('add', coco_ann, self.last_image_path,
+                                                         new_entry.mask if new_entry is not None else None))
+        self.history.push(changes)
+
     def update_superpixels(self):
         if self.image is None:
             return
         n_segments = self.slic_slider.value()
         self.slic_label.setText(f'Počet oblastí: {n_segments}')
-        segments = segmentation.slic(self.image, n_segments=n_segments, compactness=10, start_label=1)
-        edges = segmentation.find_boundaries(segments, mode='thick')
-        self.superpixel_edges = edges
+        backend = get_backend(self.backend_combo.currentData())
+        self.apply_segments(backend.segment(self.segment_image, n_segments))
+
+    def apply_segments(self, segments):
+        from annotation_engine import superpixel_edges
+        self.superpixel_labels = segments
+        self.superpixel_edges = superpixel_edges(segments)
         self.selected_components = set()
+        self.selection_mask = None
+        # Nové superpixely = nové id komponent, staré kroky historie už neplatí
+        self.history.clear()
         self.current_label = ''
         self.label_edit.setText('')
         self.recompute_components()
@@ -200,51 +474,68 @@ class SuperpixelAnnotator(QMainWindow):
             return
         border_mask = self.superpixel_edges.copy()
         for path in self.manual_borders:
-            if len(path) > 1:
-                for i in range(len(path) - 1):
-                    # Tlustá čára (2px): vykresli okolní pixely
-                    for dx in [-1, 0, 1]:
-                        for dy in [-1, 0, 1]:
-                            rr, cc = draw.line(path[i][1]+dy, path[i][0]+dx, path[i+1][1]+dy, path[i+1][0]+dx)
-                            border_mask[rr, cc] = True
-        area_mask = ~border_mask
-        labels, _ = ndi_label(area_mask)
+            self.draw_thick_path(border_mask, path, True)
+        from annotation_engine import label_components
+        labels, self.component_slices = label_components(border_mask)
         self.component_labels = labels
+        self.component_sizes = np.bincount(labels.ravel(), minlength=len(self.component_slices) + 1)
+        self.similarity_index = None
+        if self.selection_mask is None or self.selection_mask.shape != labels.shape:
+            self.selection_mask = np.zeros(labels.shape, dtype=bool)
+        # Id komponent se po přečíslování mění, výběr zůstává v pixelové masce
+        self.selected_components = set(np.unique(labels[self.selection_mask]).tolist()) - {0}
+        self.rebuild_overlay()
 
-    def display_image(self):
+    def draw_thick_path(self, target, path, value):
+        # Tlustá čára (2px): vykresli i okolní pixely, mimo obrázek se nekreslí
+        from skimage import draw
+        h, w = target.shape[:2]
+        for i in range(len(path) - 1):
+            for dx in [-1, 0, 1]:
+                for dy in [-1, 0, 1]:
+                    rr, cc = draw.line(path[i][1]+dy, path[i][0]+dx, path[i+1][1]+dy, path[i+1][0]+dx)
+                    keep = (rr >= 0) & (rr < h) & (cc >= 0) & (cc < w)
+                    target[rr[keep], cc[keep]] = value
+
+    def rebuild_overlay(self):
+        # Úplné přestavění cache overlaye - jen po změně superpixelů nebo ručních hranic
         if self.image is None or self.component_labels is None:
             return
-        overlay = self.image.copy()
-        # Zvýrazni všechny vybrané komponenty
-        for comp in self.selected_components:
-            if comp > 0:
-                mask = (self.component_labels == comp)
-                overlay = self.apply_overlay(overlay, mask, self.highlight_color)
-        # Překresli hranice superpixelů (červeně, tloušťka 2)
+        from scipy.ndimage import binary_dilation
         edge_mask = self.superpixel_edges if self.superpixel_edges is not None else np.zeros(self.image.shape[:2], dtype=bool)
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                shifted = np.roll(edge_mask, shift=(dy, dx), axis=(0, 1))
-                overlay[shifted] = [255, 0, 0]
-        # Překresli ruční hranice (červeně, tloušťka 2)
+        border = binary_dilation(edge_mask, structure=np.ones((3, 3), dtype=bool))
         for path in self.manual_borders:
-            if len(path) > 1:
-                for i in range(len(path) - 1):
-                    for dx in [-1, 0, 1]:
-                        for dy in [-1, 0, 1]:
-                            rr, cc = draw.line(path[i][1]+dy, path[i][0]+dx, path[i+1][1]+dy, path[i+1][0]+dx)
-                            overlay[rr, cc] = [255, 0, 0]
-        # Pokud právě kreslíme, vykresli aktuální čáru
+            self.draw_thick_path(border, path, True)
+        self.border_draw_mask = border
+        self.overlay = np.empty_like(self.image)
+        self.refresh_overlay_region()
+
+    def refresh_overlay_region(self, region_slices=None):
+        # Přepočítá overlay jen ve výřezu (výchozí = celý obrázek): zvýraznění výběru + červené hranice
+        if self.overlay is None:
+            return
+        sl = region_slices if region_slices is not None else (slice(None), slice(None))
+        region = self.image[sl].copy()
+        selected = self.selection_mask[sl]
+        color = self.highlight_color
+        alpha = color.alpha() / 255.0
+        rgb = np.array([color.red(), color.green(), color.blue()])
+        region[selected] = (1 - alpha) * region[selected] + alpha * rgb
+        region[self.border_draw_mask[sl]] = [255, 0, 0]
+        self.overlay[sl] = region
+
+    def display_image(self):
+        if self.image is None or self.overlay is None:
+            return
+        overlay = self.overlay
+        # Pokud právě kreslíme, vykresli aktuální čáru (do kopie, cache zůstává beze změny)
         if self.manual_mode and len(self.current_border) > 1:
-            for i in range(len(self.current_border) - 1):
-                for dx in [-1, 0, 1]:
-                    for dy in [-1, 0, 1]:
-                        rr, cc = draw.line(
-                            self.current_border[i][1]+dy, self.current_border[i][0]+dx,
-                            self.current_border[i+1][1]+dy, self.current_border[i+1][0]+dx)
-                        overlay[rr, cc] = [255, 0, 0]
-        if overlay.dtype != np.uint8:
-            overlay = (255 * (overlay / overlay.max())).astype(np.uint8)
+            overlay = overlay.copy()
+            self.draw_thick_path(overlay, self.current_border, [255, 0, 0])
+        region_path = self.region_preview_path()
+        if len(region_path) > 1:
+            overlay = overlay.copy()
+            self.draw_thick_path(overlay, region_path, [255, 255, 0])
         h, w, ch = overlay.shape
         qimg = QImage(overlay.data, w, h, ch * w, QImage.Format_RGB888)
         pixmap = QPixmap.fromImage(qimg)
@@ -254,12 +545,128 @@ class SuperpixelAnnotator(QMainWindow):
         pixmap = pixmap.scaled(self._fixed_pixmap_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
         self.image_label.setPixmap(pixmap)
 
-    def apply_overlay(self, img, mask, color):
-        img = img.copy()
-        alpha = color.alpha() / 255.0
-        rgb = np.array([color.red(), color.green(), color.blue()])
-        img[mask] = (1 - alpha) * img[mask] + alpha * rgb
-        return img
+    def event_to_image_coords(self, event):
+        # Převod pozice myši v image_label na pixel obrázku, mimo obrázek vrací None
+        pixmap = self.image_label.pixmap()
+        if self.image is None or pixmap is None:
+            return None
+        label_w = self.image_label.width()
+        label_h = self.image_label.height()
+        x = event.pos().x() - (label_w - pixmap.width()) // 2
+        y = event.pos().y() - (label_h - pixmap.height()) // 2
+        img_h, img_w = self.image.shape[:2]
+        scale = min(label_w / img_w, label_h / img_h)
+        orig_x = int(x / scale)
+        orig_y = int(y / scale)
+        if 0 <= orig_x < img_w and 0 <= orig_y < img_h:
+            return orig_x, orig_y
+        return None
+
+    def apply_brush_stroke(self, p0, p1):
+        # Razítko kruhů podél úsečky jen v jejím bboxu, bez přečíslování komponent
+        if self.selection_mask is None:
+            return
+        stamp = stroke_mask(p0, p1, self.brush_spin.value(), self.selection_mask.shape)
+        if stamp is None:
+            return
+        sl, disk = stamp
+        self.selection_mask[sl][disk] = (self.brush_mode == 'brush')
+        bbox = (sl[0].start, sl[0].stop, sl[1].start, sl[1].stop)
+        if self.stroke_bbox is None:
+            self.stroke_bbox = bbox
+        else:
+            self.stroke_bbox = (min(self.stroke_bbox[0], bbox[0]), max(self.stroke_bbox[1], bbox[1]),
+                                min(self.stroke_bbox[2], bbox[2]), max(self.stroke_bbox[3], bbox[3]))
+        self.refresh_overlay_region(sl)
+        self.display_image()
+
+    def begin_brush_stroke(self):
+        # Kopie jen bool masky; do historie jde pouze XOR rozdíl v bboxu tahu
+        self.stroke_before = self.selection_mask.copy() if self.selection_mask is not None else None
+        self.stroke_bbox = None
+
+    def end_brush_stroke(self):
+        if self.stroke_before is not None and self.stroke_bbox is not None:
+            y0, y1, x0, x1 = self.stroke_bbox
+            delta = MaskDelta.from_crops(self.stroke_before[y0:y1, x0:x1], self.selection_mask[y0:y1, x0:x1], self.stroke_bbox)
+            if delta is not None:
+                components = frozenset(self.selected_components)
+                self.history.push([SelectionChange(delta, components, components)])
+        self.stroke_before = None
+        self.stroke_bbox = None
+
+    def toggle_component(self, comp):
+        sl = self.component_slices[comp - 1]
+        if sl is None:
+            return
+        comp_mask = self.component_labels[sl] == comp
+        select = comp not in self.selected_components
+        components_before = frozenset(self.selected_components)
+        before = self.selection_mask[sl].copy()
+        if select:
+            self.selected_components.add(comp)
+        else:
+            self.selected_components.remove(comp)
+        self.selection_mask[sl][comp_mask] = select
+        bbox = (sl[0].start, sl[0].stop, sl[1].start, sl[1].stop)
+        delta = MaskDelta.from_crops(before, self.selection_mask[sl], bbox)
+        self.history.push([SelectionChange(delta, components_before, frozenset(self.selected_components))])
+        self.refresh_overlay_region(sl)
+        self.display_image()
+
+    def select_components(self, comp_ids):
+        # Hromadný výběr: lookup tabulka přes label map jen ve sjednoceném bboxu, jeden krok historie
+        comp_ids = [int(c) for c in comp_ids if c > 0 and c not in self.selected_components]
+        slices = [self.component_slices[c - 1] for c in comp_ids if self.component_slices[c - 1] is not None]
+        if not slices:
+            return
+        y0 = min(s[0].start for s in slices)
+        y1 = max(s[0].stop for s in slices)
+        x0 = min(s[1].start for s in slices)
+        x1 = max(s[1].stop for s in slices)
+        sl = (slice(y0, y1), slice(x0, x1))
+        lut = np.zeros(len(self.component_slices) + 1, dtype=bool)
+        lut[comp_ids] = True
+        components_before = frozenset(self.selected_components)
+        before = self.selection_mask[sl].copy()
+        self.selection_mask[sl] |= lut[self.component_labels[sl]]
+        self.selected_components.update(comp_ids)
+        delta = MaskDelta.from_crops(before, self.selection_mask[sl], (y0, y1, x0, x1))
+        self.history.push([SelectionChange(delta, components_before, frozenset(self.selected_components))])
+        self.refresh_overlay_region(sl)
+        self.display_image()
+
+    def region_preview_path(self):
+        # Obrys rozpracovaného obdélníku/lasa pro náhled (uzavřený)
+        if self.region_mode == 'box' and len(self.region_points) == 2:
+            (ax, ay), (bx, by) = self.region_points
+            return [(ax, ay), (bx, ay), (bx, by), (ax, by), (ax, ay)]
+        if self.region_mode == 'lasso' and len(self.region_points) > 1:
+            return self.region_points + [self.region_points[0]]
+        return []
+
+    def select_region(self):
+        # Komponenty pokryté obdélníkem/lasem: rasterizace jen v bboxu, jeden histogram labelů pod ní
+        if self.component_labels is None or self.component_sizes is None:
+            return
+        if self.region_mode == 'box' and len(self.region_points) == 2:
+            region = box_region(self.region_points[0], self.region_points[1], self.component_labels.shape)
+        else:
+            region = polygon_region(self.region_points, self.component_labels.shape)
+        if region is None:
+            return
+        sl, mask = region
+        comps = covered_components(self.component_labels[sl], mask, self.component_sizes, self.coverage_spin.value())
+        self.select_components(comps)
+
+    def select_similar(self):
+        if self.image is None or self.component_labels is None or not self.selected_components:
+            return
+        if self.similarity_index is None:
+            from region_features import SimilarityIndex
+            self.similarity_index = SimilarityIndex(self.segment_image, self.component_labels)
+        similar = self.similarity_index.similar(self.selected_components, self.similar_spin.value())
+        self.select_components(similar)
 
     def image_clicked(self, event):
         if self.manual_mode:
@@ -284,6 +691,26 @@ class SuperpixelAnnotator(QMainWindow):
                     self.display_image()
             event.accept()
             return
+        if self.brush_mode is not None:
+            if event.button() == Qt.LeftButton:
+                point = self.event_to_image_coords(event)
+                if point is not None:
+                    self.brush_last_point = point
+                    self.begin_brush_stroke()
+                    self.apply_brush_stroke(point, point)
+            event.accept()
+            return
+        if self.region_mode is not None:
+            if event.button() == Qt.LeftButton:
+                point = self.event_to_image_coords(event)
+                if point is None:
+                    self.region_points = []
+                elif self.region_mode == 'box':
+                    self.region_points = [point, point]
+                else:
+                    self.region_points = [point]
+            event.accept()
+            return
         # Multi-select komponent
         if self.image is None or self.component_labels is None:
             return
@@ -307,14 +734,28 @@ class SuperpixelAnnotator(QMainWindow):
         comp = self.component_labels[orig_y, orig_x]
         if comp == 0:
             return
-        if comp in self.selected_components:
-            self.selected_components.remove(comp)
-        else:
-            self.selected_components.add(comp)
-        self.display_image()
+        self.toggle_component(comp)
         event.accept()
 
     def image_mouse_move(self, event):
+        if self.region_mode is not None and event.buttons() & Qt.LeftButton and self.region_points:
+            point = self.event_to_image_coords(event)
+            if point is not None:
+                if self.region_mode == 'box':
+                    self.region_points[1] = point
+                else:
+                    self.region_points.append(point)
+                self.display_image()
+            event.accept()
+            return
+        if self.brush_mode is not None and event.buttons() & Qt.LeftButton:
+            point = self.event_to_image_coords(event)
+            if point is not None:
+                last = self.brush_last_point if self.brush_last_point is not None else point
+                self.apply_brush_stroke(last, point)
+                self.brush_last_point = point
+            event.accept()
+            return
         if self.manual_mode and event.buttons() & Qt.LeftButton:
             pos = event.pos()
             label_w = self.image_label.width()
@@ -337,8 +778,21 @@ class SuperpixelAnnotator(QMainWindow):
             event.accept()
 
     def image_mouse_release(self, event):
+        if self.region_mode is not None:
+            if event.button() == Qt.LeftButton and self.region_points:
+                self.select_region()
+                self.region_points = []
+                self.display_image()
+            event.accept()
+            return
+        if self.brush_mode is not None:
+            self.brush_last_point = None
+            self.end_brush_stroke()
+            event.accept()
+            return
         if self.manual_mode and event.button() == Qt.LeftButton and len(self.current_border) > 1:
             self.manual_borders.append(self.current_border[:])
+            self.history.push([BorderChange('add', len(self.manual_borders) - 1, self.current_border[:])])
             self.current_border = []
             self.recompute_components()
             self.display_image()
@@ -364,15 +818,40 @@ class SuperpixelAnnotator(QMainWindow):
 
     def remove_manual_border(self, idx):
         if 0 <= idx < len(self.manual_borders):
-            self.manual_borders.pop(idx)
+            path = self.manual_borders.pop(idx)
+            self.history.push([BorderChange('remove', idx, path)])
             self.recompute_components()
             self.display_image()
             self.update_border_panel()
 
     def keyPressEvent(self, event):
-        if event.key() == Qt.Key_C:
+        if event.matches(QKeySequence.Undo):
+            self.undo()
+            event.accept()
+        elif event.matches(QKeySequence.Redo) or (event.modifiers() & Qt.ControlModifier and event.key() == Qt.Key_Y):
+            self.redo()
+            event.accept()
+        elif event.key() == Qt.Key_C:
             self.manual_checkbox.setChecked(not self.manual_checkbox.isChecked())
             event.accept()
+        elif event.key() == Qt.Key_N:
+            self.open_next_frame()
+            event.accept()
+        elif event.key() == Qt.Key_S:
+            self.select_similar()
+            event.accept()
+        elif event.key() == Qt.Key_B:
+            self.brush_checkbox.setChecked(not self.brush_checkbox.isChecked())
+            event.accept()
+        elif event.key() == Qt.Key_E:
+            self.eraser_checkbox.setChecked(not self.eraser_checkbox.isChecked())
+            event.accept()
+        elif event.key() == Qt.Key_R:
+            self.box_checkbox.setChecked(not self.box_checkbox.isChecked())
+            event.accept()
+        elif event.key() == Qt.Key_L:
+            self.lasso_checkbox.setChecked(not self.lasso_checkbox.isChecked())
+            event.accept()
         else:
             super().keyPressEvent(event)
 
@@ -398,16 +877,10 @@ class SuperpixelAnnotator(QMainWindow):
         self.label_buttons_layout.addStretch(1)
 
     def save_coco_json_with_label(self, label):
-        if not self.selected_components or self.image is None:
+        if self.image is None or not self.has_selection():
             return
         self.current_label = label
-        coco_ann = self.create_coco_annotation(label_override=label)
-        self.segmentations.append(coco_ann)
-        self.update_seg_panel()
-        self.update_label_buttons()
-        self.new_label()  # automaticky připrav nový label
-        # --- Uložit do storage ---
-        self.save_to_storage(coco_ann)
+        self.commit_annotation(label)
 
     def save_coco_json(self):
         from PyQt5.QtWidgets import QMessageBox
@@ -415,49 +888,52 @@ class SuperpixelAnnotator(QMainWindow):
         if not label:
             QMessageBox.warning(self, 'Chyba', 'Zadejte název labelu!')
             return
-        if not self.selected_components or self.image is None:
+        if self.image is None or not self.has_selection():
             QMessageBox.warning(self, 'Chyba', 'Vyberte alespoň jednu oblast!')
             return
         self.current_label = label
-        coco_ann = self.create_coco_annotation(label_override=label)
+        self.commit_annotation(label)
+
+    def add_annotation(self, label, mask=None):
+        coco_ann = self.create_coco_annotation(label_override=label, mask=mask)
         self.segmentations.append(coco_ann)
-        self.update_seg_panel()
+        self.add_seg_row(coco_ann)
         self.update_label_buttons()
-        self.new_label()  # automaticky připrav nový label
         # --- Uložit do storage ---
-        self.save_to_storage(coco_ann)
-
-    def create_coco_annotation(self, label_override=None):
-        h, w = self.image.shape[:2]
-        annotation_id = len(self.segmentations) + 1
-        category_id = 1
-        mask = np.zeros((h, w), dtype=np.uint8)
-        for comp in self.selected_components:
-            mask = mask | (self.component_labels == comp)
-        from skimage import measure
-        segmentation = []
-        contours = measure.find_contours(mask, 0.5)
-        for contour in contours:
-            poly = []
-            for y, x in contour:
-                poly.extend([float(x), float(y)])
-            if len(poly) >= 6:
-                segmentation.append(poly)
-        area = float(np.sum(mask))
-        bbox = self.mask_to_bbox(mask)
+        entry = self.save_to_storage(coco_ann)
+        return coco_ann, entry
+
+    def commit_annotation(self, label):
+        coco_ann, entry = self.add_annotation(label)
+        # Přidání + vyčištění výběru je v historii jeden krok
+        changes = [SegmentationChange.create('add', coco_ann, self.last_image_path, entry.mask if entry is not None else None)]
+        changes.append(self.clear_selection())
+        self.history.push(changes)
+        self.new_label()  # automaticky připrav nový label
+
+    def create_coco_annotation(self, label_override=None, mask=None):
+        from annotation_engine import build_coco_annotation
+        # Monotónní čítač - po smazání se id nesmí opakovat
+        annotation_id = self.next_annotation_id
+        self.next_annotation_id += 1
+        mask = self.selection_mask if mask is None else mask
         label = label_override if label_override is not None else (self.current_label if self.current_label else f'object_{annotation_id}')
-        return {
-            "id": annotation_id,
-            "category_id": category_id,
-            "segmentation": segmentation,
-            "area": area,
-            "bbox": bbox,
-            "iscrowd": 0,
-            "label": label
-        }
+        return build_coco_annotation(annotation_id, mask, label, self.polygon_export_settings())
+
+    def polygon_export_settings(self):
+        from coco_io import PolygonExportSettings
+        return PolygonExportSettings(
+            tolerance=self.simplify_spin.value(),
+            max_vertices=self.max_vertices_spin.value() or None,
+            round_coords=self.round_coords_checkbox.isChecked()
+        )
+
+    def has_annotations(self):
+        # Importované anotace jsou jen ve storage, vlastní jsou tam taky
+        return any(self.seg_storage.get_all_segmentations().values())
 
     def show_coco_json(self):
-        if not self.segmentations:
+        if not self.has_annotations():
             return
         coco = self.create_coco_json_all()
         dlg = QDialog(self)
@@ -475,7 +951,7 @@ class SuperpixelAnnotator(QMainWindow):
         dlg.exec_()
 
     def export_all_coco_json(self):
-        if not self.segmentations:
+        if not self.has_annotations():
             return
         coco = self.create_coco_json_all()
         file_name, _ = QFileDialog.getSaveFileName(self, 'Exportovat vše do COCO JSON', 'segmentace.json', 'JSON (*.json)')
@@ -483,52 +959,72 @@ class SuperpixelAnnotator(QMainWindow):
             with open(file_name, 'w', encoding='utf-8') as f:
                 json.dump(coco, f, ensure_ascii=False, indent=2)
 
-    def create_coco_json_all(self):
-        h, w = self.image.shape[:2]
-        file_name = self.last_image_path.split('/')[-1] if self.last_image_path else 'image.png'
-        images = [{
-            "id": 1,
-            "file_name": file_name,
-            "width": w,
-            "height": h
-        }]
-        annotations = []
-        categories = []
-        cat_map = {}
-        for ann in self.segmentations:
-            annotations.append({k: v for k, v in ann.items() if k != 'label'})
-            if ann['label'] not in cat_map:
-                cat_id = len(cat_map) + 1
-                cat_map[ann['label']] = cat_id
-                categories.append({"id": cat_id, "name": ann['label']})
-            annotations[-1]['category_id'] = cat_map[ann['label']]
-        return {
-            "images": images,
-            "annotations": annotations,
-            "categories": categories
-        }
-
-    def update_seg_panel(self):
-        # Vyčistí panel
-        while self.seg_layout.count():
-            child = self.seg_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
-        # Kontrola, zda jsou segmentace platné
-        if not self.segmentations:
+    def export_training_masks(self):
+        from PyQt5.QtWidgets import QMessageBox
+        if not self.seg_storage.get_all_segmentations():
             return
-        # Generování tlačítek na základě aktuálního seznamu segmentací
-        for ann in self.segmentations:
-            label = QLabel(f"{ann['label']} (oblastí: {len(ann['segmentation'])})")
-            remove_btn = QPushButton('Smazat')
-            remove_btn.clicked.connect(lambda _, seg_id=ann['id']: self.remove_segmentation_by_id(seg_id))
-            row = QHBoxLayout()
-            row.addWidget(label)
-            row.addWidget(remove_btn)
-            row_widget = QWidget()
-            row_widget.setLayout(row)
-            self.seg_layout.addWidget(row_widget)
-        self.seg_layout.addStretch(1)
+        out_dir = QFileDialog.getExistingDirectory(self, 'Složka pro export masek')
+        if not out_dir:
+            return
+        from mask_export import export_label_pngs, export_mask_shards
+        try:
+            index = export_label_pngs(self.seg_storage, os.path.join(out_dir, 'png'))
+            export_mask_shards(self.seg_storage, os.path.join(out_dir, 'npy'))
+        except Exception as e:
+            print('Chyba při exportu masek:')
+            traceback.print_exc()
+            QMessageBox.critical(self, 'Chyba', f'Export masek selhal:\n{e}')
+            return
+        QMessageBox.information(self, 'Export', f"Exportováno obrázků: {len(index['images'])} do {out_dir}")
+
+    def create_coco_json_all(self):
+        from annotation_engine import build_coco_json, coco_annotation_from_entry
+        # Export ze storage: obsahuje importované anotace i mazání a přejmenování z vizualizačního okna.
+        # Vlastní anotace si drží polygony z commitu, importované zůstávají v kódované podobě ze souboru.
+        own = {(self.seg_image_paths.get(ann['id']), ann['id']): ann for ann in self.segmentations}
+        settings = self.polygon_export_settings()
+        records = []
+        for image_path, entries in self.seg_storage.get_all_segmentations().items():
+            if not entries:
+                continue
+            annotations = []
+            for entry in entries:
+                ann = own.get((image_path, entry.id))
+                annotations.append(dict(ann, label=entry.label) if ann is not None
+                                   else coco_annotation_from_entry(entry, settings))
+            h, w = self.image_size(image_path)
+            file_name = image_path.replace('\\', '/').split('/')[-1] or 'image.png'
+            records.append({'file_name': file_name, 'width': w, 'height': h, 'annotations': annotations})
+        return build_coco_json(records)
+
+    def image_size(self, image_path):
+        # (h, w) obrázku: aktuální snímek přímo, ostatní z masek jejich anotací ve storage
+        if image_path == self.last_image_path and self.image is not None:
+            return self.image.shape[:2]
+        for entry in self.seg_storage.get_segmentations(image_path):
+            if entry.mask is not None:
+                return entry.mask.shape[:2]
+            if entry.encoded is not None:
+                return entry.encoded['height'], entry.encoded['width']
+        return self.image.shape[:2]
+
+    def make_seg_row(self, ann):
+        label = QLabel(f"{ann['label']} (oblastí: {len(ann['segmentation'])})")
+        remove_btn = QPushButton('Smazat')
+        remove_btn.clicked.connect(lambda _, seg_id=ann['id']: self.remove_segmentation_by_id(seg_id))
+        row = QHBoxLayout()
+        row.addWidget(label)
+        row.addWidget(remove_btn)
+        row_widget = QWidget()
+        row_widget.setLayout(row)
+        self.seg_rows[ann['id']] = (row_widget, label)
+        return row_widget
+
+    def add_seg_row(self, ann):
+        # Přidá jediný řádek před koncový stretch místo přestavění panelu
+        if self.seg_layout.count() == 0:
+            self.seg_layout.addStretch(1)
+        self.seg_layout.insertWidget(self.seg_layout.count() - 1, self.make_seg_row(ann))
 
     def remove_segmentation(self, idx):
         # Tato metoda už nebude používaná pro mazání z UI, ale zachovám ji pro případné jiné použití
@@ -537,24 +1033,75 @@ class SuperpixelAnnotator(QMainWindow):
             self.remove_segmentation_by_id(seg_id)
 
     def remove_segmentation_by_id(self, seg_id):
-        # Smaže segmentaci podle id z hlavního seznamu segmentací
+        # Pokud je segmentace ve storage, smaže ji tam - zbytek udělá on_storage_event
+        image_path = self.seg_image_paths.get(seg_id)
+        if image_path is not None and self.seg_storage.get_segmentation(image_path, seg_id) is not None:
+            self.seg_storage.remove_segmentation_by_id(image_path, seg_id)
+        else:
+            self.drop_segmentation(seg_id)
+
+    def drop_segmentation(self, seg_id, entry=None):
+        # Smaže segmentaci podle id z hlavního seznamu a odebere jen její řádek
+        ann = next((s for s in self.segmentations if s['id'] == seg_id), None)
+        if ann is None:
+            return
         self.segmentations = [s for s in self.segmentations if s['id'] != seg_id]
-        # --- Synchronizace s vizualizačním oknem ---
-        if hasattr(self, 'vis_window') and self.vis_window is not None:
-            self.vis_window.refresh_segmentations(self.seg_storage.get_all_segmentations())
-        self.update_seg_panel()
+        image_path = self.seg_image_paths.pop(seg_id, None)
+        if not self.history_replaying:
+            mask = entry.get_mask() if entry is not None else None
+            self.history.push([SegmentationChange.create('remove', ann, image_path, mask)])
+        row = self.seg_rows.pop(seg_id, None)
+        if row is not None:
+            self.seg_layout.removeWidget(row[0])
+            row[0].deleteLater()
         self.update_label_buttons()
 
+    def on_storage_event(self, event):
+        # Události ze SegmentationStorage (mazání/změny z vizualizačního okna)
+        # Id jsou unikátní jen v rámci obrázku (importované anotace), proto kontrola cesty
+        if self.seg_image_paths.get(event.seg_id) != event.image_path:
+            return
+        if event.kind == EVENT_REMOVED:
+            self.drop_segmentation(event.seg_id, event.entry)
+        elif event.kind == EVENT_UPDATED:
+            for ann in self.segmentations:
+                if ann['id'] == event.seg_id and ann['label'] != event.entry.label:
+                    ann['label'] = event.entry.label
+                    row = self.seg_rows.get(event.seg_id)
+                    if row is not None:
+                        row[1].setText(f"{ann['label']} (oblastí: {len(ann['segmentation'])})")
+                    self.update_label_buttons()
+
     def mask_to_bbox(self, mask):
-        ys, xs = np.where(mask)
-        if len(xs) == 0 or len(ys) == 0:
-            return [0, 0, 0, 0]
-        x_min, x_max = xs.min(), xs.max()
-        y_min, y_max = ys.min(), ys.max()
-        return [int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)]
+        from annotation_engine import mask_to_bbox
+        return mask_to_bbox(mask)
 
-    def new_label(self):
+    def has_selection(self):
+        return self.selection_mask is not None and bool(self.selection_mask.any())
+
+    def clear_selection(self):
+        # Zruší výběr a vrátí odpovídající SelectionChange (None, pokud nebylo co rušit)
+        if self.selection_mask is None:
+            self.selected_components = set()
+            return None
+        rows = np.flatnonzero(self.selection_mask.any(axis=1))
+        change = None
+        if len(rows):
+            cols = np.flatnonzero(self.selection_mask.any(axis=0))
+            bbox = (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)
+            y0, y1, x0, x1 = bbox
+            before = self.selection_mask[y0:y1, x0:x1].copy()
+            self.selection_mask[y0:y1, x0:x1] = False
+            delta = MaskDelta.from_crops(before, self.selection_mask[y0:y1, x0:x1], bbox)
+            change = SelectionChange(delta, frozenset(self.selected_components), frozenset())
+            self.refresh_overlay_region((slice(y0, y1), slice(x0, x1)))
         self.selected_components = set()
+        return change
+
+    def new_label(self):
+        change = self.clear_selection()
+        if change is not None:
+            self.history.push([change])
         self.current_label = ''
         self.label_edit.setText('')
         self.display_image()
@@ -562,24 +1109,27 @@ class SuperpixelAnnotator(QMainWindow):
     def save_to_storage(self, coco_ann):
         if self.last_image_path is None:
             return
-        h, w = self.image.shape[:2]
-        mask = np.zeros((h, w), dtype=np.uint8)
-        from skimage.draw import polygon as skpolygon
-        for seg in coco_ann['segmentation']:
-            if len(seg) >= 6:
-                xs = seg[0::2]
-                ys = seg[1::2]
-                rr, cc = skpolygon(ys, xs, shape=mask.shape)
-                mask[rr, cc] = 1
-        entry = SegmentationEntry(
-            id=coco_ann['id'],
-            image_path=self.last_image_path,
-            label=coco_ann['label'],
-            mask=mask,
-            polygon=None,
-            color=None
-        )
+        from annotation_engine import entry_from_coco_annotation
+        entry = entry_from_coco_annotation(coco_ann, self.last_image_path, self.image.shape[:2])
+        self.seg_image_paths[entry.id] = entry.image_path
         self.seg_storage.add_segmentation(entry)
+        return entry
+
+    def import_coco_json(self):
+        from PyQt5.QtWidgets import QMessageBox
+        file_name, _ = QFileDialog.getOpenFileName(self, 'Importovat COCO JSON', '', 'JSON (*.json)')
+        if not file_name:
+            return
+        from coco_io import import_coco_json
+        try:
+            stats = import_coco_json(file_name, self.seg_storage)
+        except Exception as e:
+            QMessageBox.critical(self, 'Chyba', f'Nelze načíst COCO JSON: {file_name}\n{e}')
+            return
+        # Nové anotace nesmí dostat id kolidující s importovanými
+        self.next_annotation_id = max(self.next_annotation_id, stats['max_id'] + 1)
+        QMessageBox.information(self, 'Import', f"Načteno obrázků: {stats['images']}, anotací: {stats['annotations']}"
+                                f" (přeskočeno: {stats['skipped']}).")
 
     def open_visualization(self):
         segs = self.seg_storage.get_all_segmentations()
@@ -587,19 +1137,67 @@ class SuperpixelAnnotator(QMainWindow):
             from PyQt5.QtWidgets import QMessageBox
             QMessageBox.information(self, 'Vizualizace', 'Nejsou k dispozici žádné segmentace.')
             return
-        self.vis_window = VisualizationWindow(segs, on_delete_segmentation=self.on_delete_segmentation)
+        from visualization_window import VisualizationWindow
+        self.vis_window = VisualizationWindow(self.seg_storage)
         self.vis_window.destroyed.connect(self.on_vis_window_closed)
         self.vis_window.show()
 
-    def on_delete_segmentation(self, image_path, seg_id):
-        # Smaže segmentaci v hlavní storage i v JSON
-        self.seg_storage.remove_segmentation_by_id(image_path, seg_id)
-        self.remove_segmentation_by_id(seg_id)
-        # Kontrola, zda jsou objekty UI platné
-        if hasattr(self, 'seg_panel') and self.seg_panel is not None:
-            self.update_seg_panel()
-        if hasattr(self, 'label_buttons_widget') and self.label_buttons_widget is not None:
-            self.update_label_buttons()
+    def undo(self):
+        step = self.history.undo()
+        if step is not None:
+            self.replay_changes(reversed(step.changes), undo=True)
+
+    def redo(self):
+        step = self.history.redo()
+        if step is not None:
+            self.replay_changes(step.changes, undo=False)
+
+    def replay_changes(self, changes, undo):
+        # Aplikuje delty kroku historie; během přehrávání se nic nového nezaznamenává
+        self.history_replaying = True
+        borders_changed = False
+        try:
+            for change in changes:
+                if isinstance(change, SelectionChange):
+                    if change.delta is not None and self.selection_mask is not None:
+                        change.delta.apply(self.selection_mask)
+                        y0, y1, x0, x1 = change.delta.bbox
+                        self.refresh_overlay_region((slice(y0, y1), slice(x0, x1)))
+                    self.selected_components = set(change.components_before if undo else change.components_after)
+                elif isinstance(change, BorderChange):
+                    if (change.action == 'add') != undo:
+                        self.manual_borders.insert(change.index, list(change.path))
+                    else:
+                        self.manual_borders.pop(change.index)
+                    borders_changed = True
+                elif isinstance(change, SegmentationChange):
+                    if (change.action == 'add') != undo:
+                        self.restore_segmentation(change)
+                    else:
+                        self.remove_segmentation_by_id(change.annotation['id'])
+        finally:
+            self.history_replaying = False
+        if borders_changed:
+            self.recompute_components()
+            self.update_border_panel()
+        self.display_image()
+
+    def restore_segmentation(self, change):
+        ann = dict(change.annotation)
+        self.segmentations.append(ann)
+        self.add_seg_row(ann)
+        self.update_label_buttons()
+        mask = change.mask()
+        if change.image_path is not None and mask is not None:
+            self.seg_image_paths[ann['id']] = change.image_path
+            self.seg_storage.add_segmentation(SegmentationEntry(
+                id=ann['id'],
+                image_path=change.image_path,
+                label=ann['label'],
+                mask=mask,
+                polygon=None,
+                color=None
+            ))
 
     def on_vis_window_closed(self):
         self.vis_window = None
@@ -608,4 +1206,5 @@ if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = SuperpixelAnnotator()
     window.show()
+    threading.Thread(target=warm_up_imports, daemon=True).start()
     sys.exit(app.exec_()) 
\ No newline at end of file
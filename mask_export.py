@@ -0,0 +1,255 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from segmentation_storage import SegmentationStorage, SegmentationEntry
+
+INDEX_FILE = 'index.json'
+
+
+def category_map(storage: SegmentationStorage) -> Dict[str, int]:
+    """
+    Labely -> id tříd sémantické masky (1..N podle abecedy, 0 = pozadí).
+    """
+    labels = {e.label for segs in storage.get_all_segmentations().values() for e in segs}
+    return {label: i + 1 for i, label in enumerate(sorted(labels))}
+
+
+def _min_dtype(max_value: int):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _image_shape(entries: List[SegmentationEntry]) -> Optional[Tuple[int, int]]:
+    # Rozměr bez dekódování masky: z kódované podoby, jinak z už dekódované masky
+    for entry in entries:
+        if entry.mask is not None:
+            return tuple(entry.mask.shape[:2])
+        if entry.encoded is not None and entry.encoded.get('height') and entry.encoded.get('width'):
+            return int(entry.encoded['height']), int(entry.encoded['width'])
+    for entry in entries:
+        mask = entry.get_mask()
+        entry.release_mask()
+        if mask is not None:
+            return tuple(mask.shape[:2])
+    return None
+
+
+def rasterize_image(entries: List[SegmentationEntry], shape: Tuple[int, int], categories: Dict[str, int],
+                    instance_dtype=np.uint16, semantic_dtype=np.uint8, out_instances: Optional[np.ndarray] = None,
+                    out_semantic: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, List[dict]]:
+    """
+    Složí anotace jednoho obrázku do mapy instancí (1..k v pořadí anotací, 0 = pozadí)
+    a sémantické mapy tříd. Při překryvu vyhrává pozdější anotace, stejně jako v overlayi.
+    out_instances/out_semantic: volitelné cílové pole (např. výřez memmapu).
+    Vrací (instances, semantic, [{instance, annotation_id, label, category_id}]).
+    """
+    instances = np.zeros(shape, dtype=instance_dtype) if out_instances is None else out_instances
+    semantic = np.zeros(shape, dtype=semantic_dtype) if out_semantic is None else out_semantic
+    instances[...] = 0
+    semantic[...] = 0
+    info = []
+    for entry in entries:
+        was_decoded = entry.mask is not None
+        mask = entry.get_mask()
+        if not was_decoded:
+            entry.release_mask()
+        if mask is None or mask.shape[:2] != tuple(shape):
+            continue
+        mask = mask > 0
+        instance = len(info) + 1
+        instances[mask] = instance
+        semantic[mask] = categories[entry.label]
+        info.append({'instance': instance, 'annotation_id': entry.id, 'label': entry.label,
+                     'category_id': categories[entry.label]})
+    return instances, semantic, info
+
+
+def _palette(n: int) -> List[int]:
+    # Rozlišitelné barvy pro indexované PNG, index 0 (pozadí) je černý
+    rng = np.random.default_rng(0)
+    colors = rng.integers(40, 256, size=(256, 3), dtype=np.uint8)
+    colors[0] = 0
+    return colors[:max(n, 1)].ravel().tolist() + [0] * (3 * (256 - max(n, 1)))
+
+
+def save_indexed_png(path: str, array: np.ndarray):
+    """
+    Do 255 hodnot uloží paletové (indexované) PNG, jinak 16bitové šedotónové PNG.
+    Hodnoty pixelů jsou vždy přímo id instance/třídy.
+    """
+    max_value = int(array.max()) if array.size else 0
+    if max_value <= 255:
+        img = Image.fromarray(array.astype(np.uint8))
+        img.putpalette(_palette(max_value + 1))  # 'L' -> 'P'
+    elif max_value <= 65535:
+        img = Image.fromarray(array.astype(np.uint16))
+    else:
+        raise ValueError(f"{path}: {max_value} hodnot se do 16bitového PNG nevejde")
+    img.save(path, optimize=False)
+
+
+def _output_stems(image_paths: List[str]) -> Dict[str, str]:
+    # Jména výstupů podle jména obrázku; kolize ze stejně pojmenovaných souborů v různých složkách se očíslují
+    stems = {}
+    used = set()
+    for path in image_paths:
+        base = os.path.splitext(os.path.basename(path))[0] or 'image'
+        stem, k = base, 1
+        while stem in used:
+            stem = f"{base}_{k}"
+            k += 1
+        used.add(stem)
+        stems[path] = stem
+    return stems
+
+
+def _images_to_export(storage: SegmentationStorage, image_paths: Optional[List[str]]):
+    all_segs = storage.get_all_segmentations()
+    paths = list(image_paths) if image_paths is not None else list(all_segs.keys())
+    jobs = []
+    for path in paths:
+        entries = list(storage.get_segmentations(path))
+        shape = _image_shape(entries) if entries else None
+        if shape is not None:
+            jobs.append((path, entries, shape))
+    return jobs
+
+
+def export_label_pngs(storage: SegmentationStorage, out_dir: str, image_paths: Optional[List[str]] = None,
+                      workers: Optional[int] = None) -> dict:
+    """
+    Pro každý obrázek zapíše <jméno>_instances.png a <jméno>_semantic.png (indexované PNG,
+    hodnota pixelu = id instance / třídy) a společný index.json s mapováním instancí na anotace.
+    Obrázky se zpracovávají paralelně. Vrací obsah indexu.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    categories = category_map(storage)
+    jobs = _images_to_export(storage, image_paths)
+    stems = _output_stems([path for path, _, _ in jobs])
+    semantic_dtype = _min_dtype(len(categories))
+
+    def work(job):
+        path, entries, shape = job
+        instances, semantic, info = rasterize_image(entries, shape, categories, _min_dtype(len(entries)), semantic_dtype)
+        stem = stems[path]
+        save_indexed_png(os.path.join(out_dir, f"{stem}_instances.png"), instances)
+        save_indexed_png(os.path.join(out_dir, f"{stem}_semantic.png"), semantic)
+        return {'image_path': path, 'shape': list(shape), 'instances_file': f"{stem}_instances.png",
+                'semantic_file': f"{stem}_semantic.png", 'instances': info}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(work, jobs))
+    index = {'format': 'png', 'categories': categories, 'images': images}
+    with open(os.path.join(out_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+def export_mask_shards(storage: SegmentationStorage, out_dir: str, images_per_shard: int = 64, fmt: str = 'npy',
+                       image_paths: Optional[List[str]] = None, workers: Optional[int] = None) -> dict:
+    """
+    Zapíše masky do shardů po images_per_shard obrázcích a index.json.
+    fmt='npy': shard_XXXXX_instances.npy a shard_XXXXX_semantic.npy jsou 1D pole se všemi
+    mapami shardu za sebou (offset a shape v indexu); čtou se přes np.load(mmap_mode='r')
+    bez kopírování. Obrázky se rasterizují paralelně přímo do memmapu.
+    fmt='npz': shard_XXXXX.npz (nekomprimovaný) s poli instances_<i> a semantic_<i>.
+    Vrací obsah indexu.
+    """
+    if fmt not in ('npy', 'npz'):
+        raise ValueError(f"Neznámý formát shardů: {fmt}")
+    os.makedirs(out_dir, exist_ok=True)
+    categories = category_map(storage)
+    jobs = _images_to_export(storage, image_paths)
+    # Jeden dtype pro celý export, aby šly shardy číst stejně
+    instance_dtype = _min_dtype(max((len(entries) for _, entries, _ in jobs), default=0))
+    semantic_dtype = _min_dtype(len(categories))
+    images = []
+    shards = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shard_idx, start in enumerate(range(0, len(jobs), images_per_shard)):
+            shard_jobs = jobs[start:start + images_per_shard]
+            name = f"shard_{shard_idx:05d}"
+            if fmt == 'npy':
+                sizes = [shape[0] * shape[1] for _, _, shape in shard_jobs]
+                offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+                inst_file, sem_file = f"{name}_instances.npy", f"{name}_semantic.npy"
+                inst_mm = np.lib.format.open_memmap(os.path.join(out_dir, inst_file), mode='w+',
+                                                    dtype=instance_dtype, shape=(int(offsets[-1]),))
+                sem_mm = np.lib.format.open_memmap(os.path.join(out_dir, sem_file), mode='w+',
+                                                   dtype=semantic_dtype, shape=(int(offsets[-1]),))
+
+                def work(i, inst_mm=inst_mm, sem_mm=sem_mm, offsets=offsets, shard_jobs=shard_jobs):
+                    _, entries, shape = shard_jobs[i]
+                    region = slice(int(offsets[i]), int(offsets[i + 1]))
+                    return rasterize_image(entries, shape, categories, out_instances=inst_mm[region].reshape(shape),
+                                           out_semantic=sem_mm[region].reshape(shape))[2]
+
+                infos = list(pool.map(work, range(len(shard_jobs))))
+                inst_mm.flush()
+                sem_mm.flush()
+                del inst_mm, sem_mm
+                shards.append({'instances_file': inst_file, 'semantic_file': sem_file})
+                for i, ((path, _, shape), info) in enumerate(zip(shard_jobs, infos)):
+                    images.append({'image_path': path, 'shard': shard_idx, 'offset': int(offsets[i]),
+                                   'shape': list(shape), 'instances': info})
+            else:
+                def work(job):
+                    _, entries, shape = job
+                    return rasterize_image(entries, shape, categories, instance_dtype, semantic_dtype)
+
+                results = list(pool.map(work, shard_jobs))
+                arrays = {}
+                for i, ((path, _, shape), (instances, semantic, info)) in enumerate(zip(shard_jobs, results)):
+                    arrays[f"instances_{i}"] = instances
+                    arrays[f"semantic_{i}"] = semantic
+                    images.append({'image_path': path, 'shard': shard_idx, 'key': i,
+                                   'shape': list(shape), 'instances': info})
+                np.savez(os.path.join(out_dir, f"{name}.npz"), **arrays)
+                shards.append({'file': f"{name}.npz"})
+    index = {'format': fmt, 'categories': categories, 'instance_dtype': np.dtype(instance_dtype).name,
+             'semantic_dtype': np.dtype(semantic_dtype).name, 'shards': shards, 'images': images}
+    with open(os.path.join(out_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+class MaskShardReader:
+    """
+    Čtení shardů z export_mask_shards pro dataloader: shardy se otevírají jednou
+    (npy jako memmap) a read(i) vrací (instances, semantic) i-tého obrázku bez dekódování.
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.images = self.index['images']
+        self._open = {}
+
+    def __len__(self):
+        return len(self.images)
+
+    def _shard(self, shard_idx: int):
+        if shard_idx not in self._open:
+            shard = self.index['shards'][shard_idx]
+            if self.index['format'] == 'npy':
+                self._open[shard_idx] = (
+                    np.load(os.path.join(self.out_dir, shard['instances_file']), mmap_mode='r'),
+                    np.load(os.path.join(self.out_dir, shard['semantic_file']), mmap_mode='r'))
+            else:
+                self._open[shard_idx] = np.load(os.path.join(self.out_dir, shard['file']))
+        return self._open[shard_idx]
+
+    def read(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        image = self.images[i]
+        shape = tuple(image['shape'])
+        shard = self._shard(image['shard'])
+        if self.index['format'] == 'npy':
+            region = slice(image['offset'], image['offset'] + shape[0] * shape[1])
+            return shard[0][region].reshape(shape), shard[1][region].reshape(shape)
+        return shard[f"instances_{image['key']}"], shard[f"semantic_{image['key']}"]
@@ -0,0 +1,74 @@
+from typing import Iterable, Set
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from skimage import color
+
+# Počty binů histogramu barvy po kanálech L, a, b
+HIST_BINS = (8, 6, 6)
+LAB_RANGES = ((0.0, 100.0), (-128.0, 127.0), (-128.0, 127.0))
+
+
+def compute_component_features(image: np.ndarray, labels: np.ndarray):
+    """
+    Spočítá příznaky všech komponent najednou: průměr Lab, směrodatná odchylka Lab
+    (textura) a normalizované histogramy kanálů L, a, b.
+    Vrací (ids, features), features má jeden řádek na komponentu s id z ids.
+    """
+    rgb = image[..., :3] if image.ndim == 3 else np.stack([image] * 3, axis=-1)
+    lab = color.rgb2lab(rgb).astype(np.float32)
+    n = int(labels.max())
+    ids = np.arange(1, n + 1)
+    sizes = np.bincount(labels.ravel(), minlength=n + 1)[1:].astype(np.float32)
+    present = sizes > 0
+    ids, sizes = ids[present], sizes[present]
+    flat_labels = labels.ravel()
+    columns = []
+    for ch in range(3):
+        values = lab[..., ch].astype(np.float64)
+        mean = ndimage.sum_labels(values, labels, ids) / sizes
+        variance = ndimage.sum_labels(values * values, labels, ids) / sizes - mean * mean
+        columns.append(mean.astype(np.float32))
+        columns.append(np.sqrt(np.maximum(variance, 0)).astype(np.float32))
+    features = [np.stack(columns, axis=1)]
+    for ch, (bins, (lo, hi)) in enumerate(zip(HIST_BINS, LAB_RANGES)):
+        # Jeden bincount přes kombinovaný index (label, bin) místo smyčky přes komponenty
+        b = np.clip(((lab[..., ch].ravel() - lo) / (hi - lo) * bins).astype(np.int64), 0, bins - 1)
+        hist = np.bincount(flat_labels * bins + b, minlength=(n + 1) * bins).reshape(n + 1, bins)
+        features.append(hist[ids].astype(np.float32) / sizes[:, None])
+    return ids, np.concatenate(features, axis=1)
+
+
+class SimilarityIndex:
+    """
+    KD-strom nad standardizovanými příznaky komponent jednoho label map.
+    similar() najde všechny komponenty do zadané vzdálenosti od vybraných.
+    """
+
+    # Váhy skupin příznaků: barva, textura, histogramy
+    COLOR_WEIGHT = 1.0
+    TEXTURE_WEIGHT = 0.5
+    HIST_WEIGHT = 0.5
+
+    def __init__(self, image: np.ndarray, labels: np.ndarray):
+        self.ids, raw = compute_component_features(image, labels)
+        scale = raw.std(axis=0)
+        scale[scale == 0] = 1.0
+        features = (raw - raw.mean(axis=0)) / scale
+        weights = np.ones(features.shape[1], dtype=np.float32)
+        weights[[0, 2, 4]] = self.COLOR_WEIGHT
+        weights[[1, 3, 5]] = self.TEXTURE_WEIGHT
+        weights[6:] = self.HIST_WEIGHT / np.sqrt(sum(HIST_BINS) / 3.0)
+        self.features = features * weights
+        self.row_of = {int(c): i for i, c in enumerate(self.ids)}
+        self.tree = cKDTree(self.features)
+
+    def similar(self, component_ids: Iterable[int], threshold: float = 1.0) -> Set[int]:
+        rows = [self.row_of[int(c)] for c in component_ids if int(c) in self.row_of]
+        if not rows:
+            return set()
+        hits = self.tree.query_ball_point(self.features[rows], r=threshold)
+        found = set()
+        for h in hits:
+            found.update(h)
+        return {int(self.ids[i]) for i in found}
@@ -1,7 +1,13 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable
 from dataclasses import dataclass, field
+import traceback
 import numpy as np
 
+# Druhy událostí, které storage posílá odběratelům
+EVENT_ADDED = 'added'
+EVENT_REMOVED = 'removed'
+EVENT_UPDATED = 'updated'
+
 @dataclass
 class SegmentationEntry:
     id: int  # unikátní id segmentace
@@ -10,25 +16,92 @@ class SegmentationEntry:
     mask: np.ndarray = None  # 2D bool/uint8 mask
     polygon: Optional[List] = None  # list of (x, y)
     color: Optional[tuple] = None  # (R, G, B)
+    # COCO 'segmentation' (polygony/RLE) + 'height', 'width', 'bbox', 'area', 'iscrowd' u importovaných
+    # záznamů; maska se z něj dekóduje až v get_mask()
+    encoded: Optional[dict] = None
     # další metadata lze přidat dle potřeby
 
+    def get_mask(self) -> Optional[np.ndarray]:
+        if self.mask is None and self.encoded is not None:
+            from coco_io import decode_segmentation
+            self.mask = decode_segmentation(self.encoded['segmentation'], self.encoded['height'], self.encoded['width'])
+        return self.mask
+
+    def release_mask(self):
+        # Uvolní dekódovanou masku, jde-li znovu získat z kódované podoby
+        if self.encoded is not None:
+            self.mask = None
+
+@dataclass(frozen=True)
+class SegmentationEvent:
+    kind: str  # EVENT_ADDED / EVENT_REMOVED / EVENT_UPDATED
+    image_path: str
+    seg_id: int
+    entry: Optional[SegmentationEntry] = None  # u 'removed' je to odebraný záznam
+
 class SegmentationStorage:
     def __init__(self):
         # {image_path: [SegmentationEntry, ...]}
         self.segmentations_by_image: Dict[str, List[SegmentationEntry]] = {}
+        self._listeners: List[Callable[[SegmentationEvent], None]] = []
+
+    def subscribe(self, listener: Callable[[SegmentationEvent], None]):
+        # Odběratel dostane SegmentationEvent po každé změně jednoho záznamu
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[SegmentationEvent], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, kind: str, entry: SegmentationEntry):
+        event = SegmentationEvent(kind, entry.image_path, entry.id, entry)
+        # Kopie seznamu - odběratel se může během notifikace odhlásit
+        for listener in list(self._listeners):
+            try:
+                listener(event)
+            except Exception:
+                # Chyba jednoho pohledu nesmí rozbít storage ani ostatní odběratele
+                print(f"Chyba v odběrateli události '{kind}':")
+                traceback.print_exc()
 
     def add_segmentation(self, entry: SegmentationEntry):
         if entry.image_path not in self.segmentations_by_image:
             self.segmentations_by_image[entry.image_path] = []
         self.segmentations_by_image[entry.image_path].append(entry)
+        self._notify(EVENT_ADDED, entry)
 
     def remove_segmentation_by_id(self, image_path: str, seg_id: int):
         if image_path in self.segmentations_by_image:
             segs = self.segmentations_by_image[image_path]
+            removed = [s for s in segs if s.id == seg_id]
             self.segmentations_by_image[image_path] = [s for s in segs if s.id != seg_id]
             # NEmaž klíč, i když je seznam prázdný!
             # if not self.segmentations_by_image[image_path]:
             #     del self.segmentations_by_image[image_path]
+            for entry in removed:
+                self._notify(EVENT_REMOVED, entry)
+
+    def update_segmentation(self, image_path: str, seg_id: int, **changes) -> Optional[SegmentationEntry]:
+        # Změní vybraná pole záznamu (label, mask, polygon, color) a pošle 'updated'
+        entry = self.get_segmentation(image_path, seg_id)
+        if entry is None:
+            return None
+        for name, value in changes.items():
+            if name in ('id', 'image_path') or not hasattr(entry, name):
+                raise AttributeError(f"Pole '{name}' nelze u segmentace měnit")
+            setattr(entry, name, value)
+        if 'mask' in changes:
+            # Upravená maska už neodpovídá importované podobě
+            entry.encoded = None
+        self._notify(EVENT_UPDATED, entry)
+        return entry
+
+    def get_segmentation(self, image_path: str, seg_id: int) -> Optional[SegmentationEntry]:
+        for entry in self.segmentations_by_image.get(image_path, []):
+            if entry.id == seg_id:
+                return entry
+        return None
 
     def get_segmentations(self, image_path: str) -> List[SegmentationEntry]:
         return self.segmentations_by_image.get(image_path, [])
@@ -37,4 +110,7 @@ class SegmentationStorage:
         return self.segmentations_by_image
 
     def clear(self):
-        self.segmentations_by_image.clear() 
\ No newline at end of file
+        removed = [e for segs in self.segmentations_by_image.values() for e in segs]
+        self.segmentations_by_image.clear()
+        for entry in removed:
+            self._notify(EVENT_REMOVED, entry)
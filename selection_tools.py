@@ -0,0 +1,101 @@
+from typing import Tuple
+import numpy as np
+
+
+def clip_bbox(y0, y1, x0, x1, shape):
+    """
+    Ořízne bbox (y0, y1, x0, x1; konec exkluzivní) na rozměry obrázku. Vrací None, pokud je prázdný.
+    """
+    h, w = shape[:2]
+    y0, y1 = max(int(y0), 0), min(int(y1), h)
+    x0, x1 = max(int(x0), 0), min(int(x1), w)
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return y0, y1, x0, x1
+
+
+def stroke_mask(p0, p1, radius, shape):
+    """
+    Rasterizuje tah štětce z bodu p0 do p1 (x, y) kruhem o poloměru radius.
+    Sjednocení kruhů podél úsečky = pixely do vzdálenosti radius od úsečky,
+    počítá se vektorově jen v bboxu tahu.
+    Vrací (slices, mask) pro přímé použití jako target[slices][mask], nebo None.
+    """
+    (ax, ay), (bx, by) = p0, p1
+    r = max(float(radius), 0.5)
+    bbox = clip_bbox(np.floor(min(ay, by) - r), np.ceil(max(ay, by) + r) + 1,
+                     np.floor(min(ax, bx) - r), np.ceil(max(ax, bx) + r) + 1, shape)
+    if bbox is None:
+        return None
+    y0, y1, x0, x1 = bbox
+    ys = np.arange(y0, y1, dtype=np.float32)[:, None]
+    xs = np.arange(x0, x1, dtype=np.float32)[None, :]
+    dx, dy = float(bx - ax), float(by - ay)
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        t = 0.0
+    else:
+        # Parametr nejbližšího bodu úsečky pro každý pixel
+        t = np.clip(((xs - ax) * dx + (ys - ay) * dy) / length2, 0.0, 1.0)
+    dist2 = (xs - (ax + t * dx)) ** 2 + (ys - (ay + t * dy)) ** 2
+    return (slice(y0, y1), slice(x0, x1)), dist2 <= r * r
+
+
+def fill_polygon(xs: np.ndarray, ys: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Vektorová scanline rasterizace polygonu (even-odd, středy pixelů v celých souřadnicích).
+    Na rozdíl od skimage.draw.polygon nezávisí cena na počtu vrcholů krát plocha.
+    """
+    h, w = shape
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    xe, ye = np.roll(xs, -1), np.roll(ys, -1)
+    r_start = np.clip(np.ceil(np.minimum(ys, ye)), 0, h).astype(np.int64)
+    r_end = np.clip(np.ceil(np.maximum(ys, ye)), 0, h).astype(np.int64)
+    counts = np.maximum(r_end - r_start, 0)
+    edge = np.repeat(np.arange(len(xs)), counts)
+    rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + r_start[edge]
+    # Průsečík řádku s hranou; u hran s counts > 0 je ye != ys
+    t = (rows - ys[edge]) / (ye[edge] - ys[edge])
+    cols = np.clip(np.ceil(xs[edge] + t * (xe[edge] - xs[edge])), 0, w).astype(np.int64)
+    crossings = np.zeros((h, w + 1), dtype=np.int32)
+    np.add.at(crossings, (rows, cols), 1)
+    return (np.cumsum(crossings[:, :w], axis=1) & 1).astype(bool)
+
+
+def polygon_region(points, shape):
+    """
+    Rasterizuje uzavřený polygon (laso, seznam bodů (x, y)) jen v jeho bboxu.
+    Vrací (slices, mask) jako stroke_mask, nebo None.
+    """
+    if len(points) < 3:
+        return None
+    pts = np.asarray(points, dtype=np.float64)
+    bbox = clip_bbox(np.floor(pts[:, 1].min()), np.ceil(pts[:, 1].max()) + 1,
+                     np.floor(pts[:, 0].min()), np.ceil(pts[:, 0].max()) + 1, shape)
+    if bbox is None:
+        return None
+    y0, y1, x0, x1 = bbox
+    mask = fill_polygon(pts[:, 0] - x0, pts[:, 1] - y0, (y1 - y0, x1 - x0))
+    return (slice(y0, y1), slice(x0, x1)), mask
+
+
+def box_region(p0, p1, shape):
+    # Obdélník mezi dvěma rohy (x, y) včetně krajních pixelů
+    (ax, ay), (bx, by) = p0, p1
+    bbox = clip_bbox(min(ay, by), max(ay, by) + 1, min(ax, bx), max(ax, bx) + 1, shape)
+    if bbox is None:
+        return None
+    y0, y1, x0, x1 = bbox
+    return (slice(y0, y1), slice(x0, x1)), np.ones((y1 - y0, x1 - x0), dtype=bool)
+
+
+def covered_components(labels_crop, region, component_sizes, min_coverage):
+    """
+    Id komponent, jejichž plochu oblast (bool maska nad labels_crop) pokrývá alespoň
+    z min_coverage. Jeden histogram labelů pod oblastí, component_sizes = bincount celé label mapy.
+    """
+    covered = np.bincount(labels_crop[region], minlength=len(component_sizes))[:len(component_sizes)]
+    fraction = covered / np.maximum(component_sizes, 1)
+    fraction[0] = 0
+    return np.flatnonzero(fraction >= min_coverage)
@@ -0,0 +1,100 @@
+from typing import List, Optional
+import numpy as np
+from scipy import ndimage
+from skimage import color, filters, segmentation
+
+
+def superpixel_centroids(labels: np.ndarray):
+    """
+    Vrátí (ids, cy, cx) těžišť všech superpixelů jedním průchodem přes bincount.
+    """
+    n = int(labels.max())
+    flat = labels.ravel()
+    sizes = np.bincount(flat, minlength=n + 1)
+    ys, xs = np.indices(labels.shape)
+    sum_y = np.bincount(flat, weights=ys.ravel(), minlength=n + 1)
+    sum_x = np.bincount(flat, weights=xs.ravel(), minlength=n + 1)
+    ids = np.flatnonzero(sizes)
+    ids = ids[ids > 0]
+    return ids, sum_y[ids] / sizes[ids], sum_x[ids] / sizes[ids]
+
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    gray = color.rgb2gray(image[..., :3]) if image.ndim == 3 else image
+    return gray.astype(np.float32)
+
+
+def frames_compatible(prev_image: np.ndarray, image: np.ndarray, max_mean_diff: float = 0.15) -> bool:
+    """
+    Hrubý test střihu scény: průměrný absolutní rozdíl jasu na zmenšených snímcích.
+    """
+    if prev_image is None or prev_image.shape[:2] != image.shape[:2]:
+        return False
+    step = max(1, max(image.shape[:2]) // 256)
+    a = _gray(prev_image[::step, ::step])
+    b = _gray(image[::step, ::step])
+    scale = max(float(a.max()), float(b.max()), 1e-6)
+    return float(np.mean(np.abs(a - b))) / scale <= max_mean_diff
+
+
+def warm_start_superpixels(image: np.ndarray, prev_labels: np.ndarray, core_fraction: float = 0.15,
+                           compactness: float = 0.001) -> np.ndarray:
+    """
+    Superpixely navazující na předchozí snímek. skimage.slic neumí začít z daných
+    center, proto se použije kompaktní watershed na gradientu nového snímku,
+    semínkovaný jádry superpixelů předchozího snímku (pixely dál než
+    core_fraction * velikost superpixelu od hranice). Id superpixelů se přenáší:
+    label k v novém snímku roste z jádra labelu k v předchozím.
+    """
+    n = max(int(prev_labels.max()), 1)
+    spacing = np.sqrt(prev_labels.size / n)
+    inner = ndimage.distance_transform_edt(~segmentation.find_boundaries(prev_labels, mode='inner'))
+    markers = np.where(inner > core_fraction * spacing, prev_labels, 0).astype(np.int32)
+    # Superpixel menší než jádro dostane aspoň semínko v těžišti
+    ids, cy, cx = superpixel_centroids(prev_labels)
+    missing = np.ones(n + 1, dtype=bool)
+    missing[np.unique(markers)] = False
+    h, w = image.shape[:2]
+    rows = np.clip(np.round(cy).astype(np.int64), 0, h - 1)
+    cols = np.clip(np.round(cx).astype(np.int64), 0, w - 1)
+    sel = missing[ids]
+    markers[rows[sel], cols[sel]] = ids[sel]
+    gradient = filters.sobel(_gray(image))
+    return segmentation.watershed(gradient, markers=markers, compactness=compactness)
+
+
+def _mean_colors(image: np.ndarray, labels: np.ndarray, n: int) -> np.ndarray:
+    rgb = image[..., :3] if image.ndim == 3 else image[..., None]
+    flat = labels.ravel()
+    sizes = np.maximum(np.bincount(flat, minlength=n + 1), 1)
+    channels = [np.bincount(flat, weights=rgb[..., c].ravel().astype(np.float64), minlength=n + 1) / sizes
+                for c in range(rgb.shape[-1])]
+    return np.stack(channels, axis=1)
+
+
+def propagate_masks(prev_labels: np.ndarray, labels: np.ndarray, prev_image: np.ndarray, image: np.ndarray,
+                    masks: List[np.ndarray], min_coverage: float = 0.5,
+                    max_color_dist: Optional[float] = 0.15) -> List[Optional[np.ndarray]]:
+    """
+    Přenese masky předchozího snímku na nový přes shodná id superpixelů
+    (viz warm_start_superpixels). Superpixel patří do nové masky, pokud ho stará
+    maska pokrývala alespoň z min_coverage a jeho průměrná barva se nezměnila
+    o víc než max_color_dist (relativně k rozsahu hodnot obrázku).
+    Pro masky, které se nepodařilo přenést, vrací None.
+    """
+    n = int(max(prev_labels.max(), labels.max()))
+    flat_prev = prev_labels.ravel()
+    sizes = np.maximum(np.bincount(flat_prev, minlength=n + 1), 1)
+    color_ok = np.ones(n + 1, dtype=bool)
+    if max_color_dist is not None:
+        scale = max(float(np.max(image)), 1.0)
+        diff = _mean_colors(prev_image, prev_labels, n) - _mean_colors(image, labels, n)
+        color_ok = np.sqrt((diff ** 2).mean(axis=1)) / scale <= max_color_dist
+    color_ok[0] = False
+    result = []
+    for mask in masks:
+        covered = np.bincount(flat_prev, weights=(np.asarray(mask) > 0).ravel(), minlength=n + 1) / sizes
+        lut = (covered >= min_coverage) & color_ok
+        new_mask = lut[labels]
+        result.append(new_mask.astype(np.uint8) if new_mask.any() else None)
+    return result
@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+import subprocess
+
+# Rozpočet pro import main_2 a vytvoření okna (bez skimage/scipy), v sekundách
+STARTUP_BUDGET = 1.0
+# Moduly, které se při startu načíst nesmí - patří do warm_up_imports na pozadí
+FORBIDDEN_AT_STARTUP = ('skimage', 'scipy', 'coco_io', 'region_features', 'sequence_tracking',
+                        'annotation_engine', 'visualization_window', 'visualization_logic')
+
+_PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import main_2
+t1 = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+window = main_2.SuperpixelAnnotator()
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'window': t2 - t0,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_startup() -> dict:
+    """
+    Změří v čistém interpretu dobu importu main_2 a vytvoření SuperpixelAnnotator.
+    Vrací {'import': s, 'window': s, 'loaded': [těžké moduly načtené při startu]}.
+    """
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    root = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run([sys.executable, '-c', _PROBE % (FORBIDDEN_AT_STARTUP,)], cwd=root, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    result = measure_startup()
+    print(f"import main_2: {result['import']:.3f} s, okno vytvořeno: {result['window']:.3f} s "
+          f"(rozpočet {STARTUP_BUDGET:.1f} s)")
+    ok = True
+    if result['window'] > STARTUP_BUDGET:
+        print("Start překročil rozpočet.")
+        ok = False
+    if result['loaded']:
+        print(f"Při startu se načetly těžké moduly: {', '.join(result['loaded'])}")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
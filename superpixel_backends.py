@@ -0,0 +1,134 @@
+from typing import Dict, List
+import numpy as np
+
+# skimage se importuje až uvnitř _segment(), aby import modulu nezdržoval start aplikace
+
+
+class SuperpixelBackend:
+    """
+    Rozhraní pro over-segmentaci obrázku.
+    segment() vrací 2D int pole labelů číslovaných od 1 (0 se nepoužívá).
+    Je-li nastaveno max_side, počítá se na zmenšeném obrázku a labely se zpět
+    zvětší nejbližším sousedem (hranice pak mají přesnost na faktor zmenšení).
+    """
+    name = ''
+    title = ''
+    speed = ''  # orientační profil rychlost/kvalita pro UI
+    quality = ''
+    max_side = None
+
+    def segment(self, image: np.ndarray, n_segments: int) -> np.ndarray:
+        h, w = image.shape[:2]
+        step = int(np.ceil(max(h, w) / self.max_side)) if self.max_side else 1
+        if step <= 1:
+            return self._segment(image, n_segments)
+        small = self._segment(image[::step, ::step], n_segments)
+        rows = np.minimum(np.arange(h) // step, small.shape[0] - 1)
+        cols = np.minimum(np.arange(w) // step, small.shape[1] - 1)
+        return small[rows[:, None], cols[None, :]]
+
+    def _segment(self, image: np.ndarray, n_segments: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return f"{self.title} - rychlost: {self.speed}, kvalita hranic: {self.quality}"
+
+
+class SlicBackend(SuperpixelBackend):
+    name = 'slic'
+    title = 'SLIC'
+    speed = 'střední'
+    quality = 'vysoká'
+
+    def __init__(self, compactness=10, slic_zero=False):
+        self.compactness = compactness
+        self.slic_zero = slic_zero
+
+    def _segment(self, image, n_segments):
+        from skimage import segmentation
+        return segmentation.slic(image, n_segments=n_segments, compactness=self.compactness,
+                                 slic_zero=self.slic_zero, start_label=1)
+
+
+class SlicZeroBackend(SlicBackend):
+    # SLICO: kompaktnost se přizpůsobuje každému superpixelu, bez ladění parametru
+    name = 'slic_zero'
+    title = 'SLIC zero (SLICO)'
+    speed = 'střední'
+    quality = 'vysoká, pravidelnější tvary'
+
+    def __init__(self, compactness=0.1):
+        super().__init__(compactness=compactness, slic_zero=True)
+
+
+class FastSlicBackend(SlicBackend):
+    # SLIC na zmenšeném obrázku, labely se zpět zvětší nejbližším sousedem
+    name = 'slic_fast'
+    title = 'SLIC rychlý (zmenšený)'
+    speed = 'vysoká'
+    quality = 'hranice s přesností na faktor zmenšení'
+
+    def __init__(self, compactness=10, max_side=512):
+        super().__init__(compactness=compactness)
+        self.max_side = max_side
+
+
+class FelzenszwalbBackend(SuperpixelBackend):
+    name = 'felzenszwalb'
+    title = 'Felzenszwalb'
+    speed = 'vysoká'
+    quality = 'sleduje hrany, nepravidelné velikosti'
+
+    def __init__(self, sigma=0.8, max_side=768):
+        self.sigma = sigma
+        self.max_side = max_side
+
+    def _segment(self, image, n_segments):
+        # Algoritmus nemá počet oblastí jako parametr - scale a min_size odvodíme z plochy
+        from skimage import segmentation
+        h, w = image.shape[:2]
+        area_per_segment = h * w / max(n_segments, 1)
+        labels = segmentation.felzenszwalb(image, scale=area_per_segment / 20, sigma=self.sigma,
+                                           min_size=int(area_per_segment / 4),
+                                           channel_axis=-1 if image.ndim == 3 else None)
+        return labels + 1
+
+
+class WatershedBackend(SuperpixelBackend):
+    name = 'watershed'
+    title = 'Watershed na gradientu'
+    speed = 'velmi vysoká'
+    quality = 'sleduje hrany, méně pravidelné'
+
+    def __init__(self, compactness=0.001, max_side=1024):
+        self.compactness = compactness
+        self.max_side = max_side
+
+    def _segment(self, image, n_segments):
+        from skimage import segmentation, color, filters
+        gray = color.rgb2gray(image[..., :3]) if image.ndim == 3 else image
+        gradient = filters.sobel(gray.astype(np.float32))
+        return segmentation.watershed(gradient, markers=n_segments, compactness=self.compactness)
+
+
+BACKENDS: Dict[str, SuperpixelBackend] = {}
+
+
+def register_backend(backend: SuperpixelBackend):
+    BACKENDS[backend.name] = backend
+
+
+def get_backend(name: str) -> SuperpixelBackend:
+    if name not in BACKENDS:
+        raise KeyError(f"Neznámý superpixel backend: {name}")
+    return BACKENDS[name]
+
+
+def available_backends() -> List[SuperpixelBackend]:
+    return list(BACKENDS.values())
+
+
+for _backend in (SlicBackend(), SlicZeroBackend(), FastSlicBackend(), FelzenszwalbBackend(), WatershedBackend()):
+    register_backend(_backend)
+
+DEFAULT_BACKEND = SlicBackend.name
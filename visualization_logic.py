@@ -1,6 +1,6 @@
 import numpy as np
-from PyQt5.QtGui import QImage, QPixmap, QPainter, QColor, QPen, QBrush
-from PyQt5.QtCore import QRect, QPoint
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QColor, QPen, QPolygon
+from PyQt5.QtCore import QPoint
 from skimage import measure
 
 
@@ -24,83 +24,147 @@ def np_to_qimage(np_img):
         raise ValueError("Unsupported image shape for QImage conversion.")
 
 
-def draw_segmentation_overlay(
-    base_image: np.ndarray,
-    segmentations: list,
-    alpha: float = 0.4,
-    color_map=None,
-    draw_labels=True,
-    label_font=None
-) -> QPixmap:
+NO_SEGMENTATION = -1  # hodnota v mapě top_ids tam, kde žádná segmentace není
+
+
+def mask_bbox(mask):
+    """
+    Vrátí bbox masky jako (y0, y1, x0, x1) s exkluzivním koncem, nebo None pro prázdnou masku.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+
+def _to_rgb(color):
+    if isinstance(color, tuple):
+        color = QColor(*color)
+    elif not isinstance(color, QColor):
+        color = QColor(color)
+    return color
+
+
+class OverlayCache:
     """
-    Vykreslí overlay segmentací na obrázek.
-    segmentations: list of dicts, každý má 'mask' (2D bool/uint8), 'label', 'color' (QColor or tuple), optional 'polygon', optional 'outline_width'
+    Předpočítaný overlay segmentací jednoho obrázku.
+    Výplně masek se drží v numpy plátně, obrysy jako hotové QPolygony, takže
+    přidání/odebrání/změna jedné segmentace přepočítá jen její bbox.
+    Spolu s plátnem se udržuje int32 mapa id nejvrchnější segmentace (top_ids)
+    pro hit-testing v konstantním čase.
     """
-    qimage = np_to_qimage(base_image)
-    pixmap = QPixmap.fromImage(qimage)
-    painter = QPainter(pixmap)
-    try:
-        if label_font:
-            painter.setFont(label_font)
-
-        for idx, seg in enumerate(segmentations):
-            mask = seg.get('mask')  # 2D numpy array
-            color = seg.get('color')
-            outline_width = seg.get('outline_width', 4)
-            if color is None and color_map:
-                color = color_map(idx)
-            if color is None:
-                color = QColor.fromHsv((idx * 37) % 360, 255, 255, int(255 * alpha))
-            elif isinstance(color, tuple):
-                color = QColor(*color)
-            else:
-                color = QColor(color)
-            
-            # Draw mask overlay
-            if mask is not None:
-                overlay = np.zeros((mask.shape[0], mask.shape[1], 4), dtype=np.uint8)
-                overlay[mask > 0] = [color.red(), color.green(), color.blue(), int(255 * alpha)]
-                overlay_img = np_to_qimage(overlay)
-                painter.drawImage(0, 0, overlay_img)
-            # Draw polygon/outline if present
-            polygon = seg.get('polygon')
-            if polygon is not None and len(polygon) > 1:
-                pen = QPen(color, outline_width)
-                painter.setPen(pen)
-                points = [QPoint(int(x), int(y)) for x, y in polygon]
-                for i in range(len(points) - 1):
-                    painter.drawLine(points[i], points[i + 1])
-                # Optionally close polygon
-                if np.allclose(polygon[0], polygon[-1]):
-                    painter.drawLine(points[-1], points[0])
-            # Pokud není polygon, vykresli outline přes kontury masky
-            elif mask is not None:
-                contours = measure.find_contours(mask, 0.5)
-                pen = QPen(color, outline_width)
-                painter.setPen(pen)
-                for contour in contours:
-                    points = [QPoint(int(x), int(y)) for y, x in contour]
-                    for i in range(len(points) - 1):
-                        painter.drawLine(points[i], points[i + 1])
-            # Draw label
-            if draw_labels and 'label' in seg:
-                label = seg['label']
-                # Najít centroid masky nebo polygonu
-                if mask is not None:
-                    ys, xs = np.where(mask)
-                    if len(xs) > 0:
-                        cx, cy = int(xs.mean()), int(ys.mean())
-                    else:
-                        cx, cy = 10, 10
-                elif polygon is not None:
-                    xs, ys = zip(*polygon)
-                    cx, cy = int(np.mean(xs)), int(np.mean(ys))
-                else:
-                    cx, cy = 10, 10
-                painter.setPen(QPen(QColor(0, 0, 0, 200), 2))
-                painter.drawText(cx + 1, cy + 1, label)
-                painter.setPen(QPen(QColor(255, 255, 255, 255), 1))
-                painter.drawText(cx, cy, label)
-    finally:
-        painter.end()
-    return pixmap 
\ No newline at end of file
+
+    def __init__(self, base_image: np.ndarray, alpha: float = 0.4):
+        self.base = np.ascontiguousarray(base_image)
+        self.canvas = self.base.copy()
+        self.top_ids = np.full(self.base.shape[:2], NO_SEGMENTATION, dtype=np.int32)
+        self.alpha = alpha
+        self._items = {}  # {seg_id: dict}, pořadí vložení = pořadí vykreslení
+
+    def __contains__(self, seg_id):
+        return seg_id in self._items
+
+    def ids(self):
+        return list(self._items.keys())
+
+    def hit_test(self, x, y):
+        """
+        Vrátí id segmentace nahoře v bodě (x, y) obrázku, nebo None.
+        """
+        h, w = self.top_ids.shape
+        if not (0 <= x < w and 0 <= y < h):
+            return None
+        seg_id = int(self.top_ids[y, x])
+        return None if seg_id == NO_SEGMENTATION else seg_id
+
+    def add(self, seg_id, mask, label, color):
+        item = self._make_item(mask, label, color)
+        self._items[seg_id] = item
+        if item['bbox'] is not None:
+            self._blend(seg_id, item, item['bbox'])
+
+    def remove(self, seg_id):
+        item = self._items.pop(seg_id, None)
+        if item is not None and item['bbox'] is not None:
+            self._recompose(item['bbox'])
+
+    def update(self, seg_id, mask, label, color):
+        old = self._items.get(seg_id)
+        if old is None:
+            self.add(seg_id, mask, label, color)
+            return
+        item = self._make_item(mask, label, color)
+        self._items[seg_id] = item  # zachová pořadí
+        for bbox in (old['bbox'], item['bbox']):
+            if bbox is not None:
+                self._recompose(bbox)
+
+    def _make_item(self, mask, label, color):
+        color = _to_rgb(color)
+        h, w = self.canvas.shape[:2]
+        mask = np.asarray(mask)[:h, :w] > 0
+        bbox = mask_bbox(mask)
+        item = {'label': label, 'color': color, 'bbox': bbox, 'mask': None,
+                'contours': [], 'centroid': (10, 10)}
+        if bbox is None:
+            return item
+        y0, y1, x0, x1 = bbox
+        crop = mask[y0:y1, x0:x1]
+        item['mask'] = crop
+        # Okraj 1 px, aby se obrysy dotýkající se bboxu uzavřely
+        padded = np.pad(crop, 1)
+        for contour in measure.find_contours(padded, 0.5):
+            item['contours'].append(QPolygon([
+                QPoint(int(x) + x0 - 1, int(y) + y0 - 1) for y, x in contour
+            ]))
+        ys, xs = np.nonzero(crop)
+        item['centroid'] = (int(xs.mean()) + x0, int(ys.mean()) + y0)
+        return item
+
+    def _blend(self, seg_id, item, bbox):
+        # Alfa blending masky položky do plátna, jen v průniku bboxů
+        iy0, iy1, ix0, ix1 = item['bbox']
+        y0, y1 = max(iy0, bbox[0]), min(iy1, bbox[1])
+        x0, x1 = max(ix0, bbox[2]), min(ix1, bbox[3])
+        if y0 >= y1 or x0 >= x1:
+            return
+        m = item['mask'][y0 - iy0:y1 - iy0, x0 - ix0:x1 - ix0]
+        region = self.canvas[y0:y1, x0:x1]
+        c = item['color']
+        rgb = np.array([c.red(), c.green(), c.blue()], dtype=np.float32)
+        region[m] = ((1 - self.alpha) * region[m] + self.alpha * rgb).astype(self.canvas.dtype)
+        self.top_ids[y0:y1, x0:x1][m] = seg_id
+
+    def _recompose(self, bbox):
+        y0, y1, x0, x1 = bbox
+        self.canvas[y0:y1, x0:x1] = self.base[y0:y1, x0:x1]
+        self.top_ids[y0:y1, x0:x1] = NO_SEGMENTATION
+        for seg_id, item in self._items.items():
+            if item['bbox'] is not None:
+                self._blend(seg_id, item, bbox)
+
+    def render(self, outline_widths=None, draw_labels=True, label_font=None) -> QPixmap:
+        """
+        Složí plátno s obrysy a popisky. outline_widths: {seg_id: šířka}, výchozí 4.
+        """
+        outline_widths = outline_widths or {}
+        pixmap = QPixmap.fromImage(np_to_qimage(self.canvas))
+        painter = QPainter(pixmap)
+        try:
+            if label_font:
+                painter.setFont(label_font)
+            for seg_id, item in self._items.items():
+                painter.setPen(QPen(item['color'], outline_widths.get(seg_id, 4)))
+                for poly in item['contours']:
+                    painter.drawPolyline(poly)
+            if draw_labels:
+                for item in self._items.values():
+                    cx, cy = item['centroid']
+                    painter.setPen(QPen(QColor(0, 0, 0, 200), 2))
+                    painter.drawText(cx + 1, cy + 1, item['label'])
+                    painter.setPen(QPen(QColor(255, 255, 255, 255), 1))
+                    painter.drawText(cx, cy, item['label'])
+        finally:
+            painter.end()
+        return pixmap
@@ -1,40 +1,36 @@
 import sys
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QListWidget, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QSizePolicy, QMessageBox, QFrame
+    QApplication, QMainWindow, QWidget, QListWidget, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QSizePolicy, QMessageBox, QFrame,
+    QDialog, QTextEdit, QDialogButtonBox
 )
 from PyQt5.QtGui import QPixmap, QColor
 from PyQt5.QtCore import Qt
 import numpy as np
-from visualization_logic import draw_segmentation_overlay
+from visualization_logic import OverlayCache
+from segmentation_storage import EVENT_ADDED, EVENT_REMOVED, EVENT_UPDATED
+from annotation_qa import run_qa, format_report
+from display_lut import IMAGE_FILE_FILTER
 import traceback
 
 
-def segmentation_entry_to_dict(entry):
-    # Pomocná funkce pro převod SegmentationEntry na dict kompatibilní s vizualizací
-    return {
-        'mask': entry.mask,
-        'label': entry.label,
-        'color': entry.color,
-        'polygon': entry.polygon
-    }
-
 def get_label_color(label):
     # Jednotná barva pro každý label (hash + HSV)
     h = abs(hash(label)) % 360
     return QColor.fromHsv(h, 200, 255)
 
 class VisualizationWindow(QMainWindow):
-    def __init__(self, segmentations_by_image, parent=None, on_delete_segmentation=None):
+    def __init__(self, seg_storage, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Vizualizace segmentací")
         self.resize(1200, 800)
-        self.segmentations_by_image = segmentations_by_image  # dict: {image_path: [SegmentationEntry, ...]}
-        self.image_paths = list(segmentations_by_image.keys())
+        self.seg_storage = seg_storage  # SegmentationStorage, okno odebírá jeho události
+        self.image_paths = list(seg_storage.get_all_segmentations().keys())
+        self.image_path_set = set(self.image_paths)  # rychlý test členství pro on_storage_event
         self.current_image = None
-        self.current_segmentations = None
         self.current_np_image = None
-        self.selected_segmentation_idx = None
-        self.on_delete_segmentation = on_delete_segmentation
+        self.overlay_cache = None  # OverlayCache aktuálního obrázku
+        self.selected_segmentation_id = None
+        self.seg_rows = {}  # {seg_id: (row_widget, label_btn)}
 
         # UI
         self.list_widget = QListWidget()
@@ -45,9 +41,15 @@ class VisualizationWindow(QMainWindow):
         self.image_label = QLabel("Vyberte obrázek vlevo")
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.image_label.setMouseTracking(True)
+        self.image_label.mousePressEvent = self.image_clicked
+        self.image_label.mouseMoveEvent = self.image_mouse_move
+        self.hovered_segmentation_id = None
 
         reload_btn = QPushButton("Načíst obrázek ze souboru")
         reload_btn.clicked.connect(self.load_image_from_disk)
+        qa_btn = QPushButton("Kontrola kvality anotací")
+        qa_btn.clicked.connect(self.show_qa_report)
 
         # Panel se segmentacemi
         self.seg_panel = QWidget()
@@ -60,6 +62,7 @@ class VisualizationWindow(QMainWindow):
         left_layout = QVBoxLayout()
         left_layout.addWidget(self.list_widget)
         left_layout.addWidget(reload_btn)
+        left_layout.addWidget(qa_btn)
         left_widget = QWidget()
         left_widget.setLayout(left_layout)
 
@@ -71,19 +74,32 @@ class VisualizationWindow(QMainWindow):
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
+        self.seg_storage.subscribe(self.on_storage_event)
+
+    @property
+    def current_segmentations(self):
+        if self.current_image is None:
+            return []
+        return self.seg_storage.get_segmentations(self.current_image)
+
     def on_image_selected(self, row):
         if row < 0 or row >= len(self.image_paths):
             self.image_label.setText("Vyberte obrázek vlevo")
-            self.seg_layout.setParent(None)
-            self.selected_segmentation_idx = None
+            self.current_image = None
+            self.overlay_cache = None
+            self.selected_segmentation_id = None
+            self.update_seg_panel()
             return
         image_path = self.image_paths[row]
+        if self.current_image is not None and self.current_image != image_path:
+            # Importované masky se drží dekódované jen pro otevřený obrázek
+            for entry in self.current_segmentations:
+                entry.release_mask()
         self.current_image = image_path
-        self.current_segmentations = self.segmentations_by_image[image_path]
-        self.selected_segmentation_idx = None
+        self.selected_segmentation_id = None
         try:
             np_img = self.load_image(image_path)
-            self.current_np_image = np_img
+            self.set_np_image(np_img)
             self.update_seg_panel()
             self.update_overlay()
         except Exception as e:
@@ -91,181 +107,257 @@ class VisualizationWindow(QMainWindow):
             traceback.print_exc()
             self.image_label.setText(f"Nelze načíst obrázek: {image_path}\n{e}")
 
+    def set_np_image(self, np_img):
+        # Nový podklad = jediné místo, kde se overlay skládá celý
+        self.current_np_image = np_img
+        self.overlay_cache = OverlayCache(np_img)
+        for entry in self.current_segmentations:
+            self.overlay_cache.add(entry.id, entry.get_mask(), entry.label, get_label_color(entry.label))
+
+    def on_storage_event(self, event):
+        # Inkrementální aktualizace: mění se jen dotčený řádek a bbox overlaye
+        if event.kind == EVENT_ADDED and event.image_path not in self.image_path_set:
+            self.image_paths.append(event.image_path)
+            self.image_path_set.add(event.image_path)
+            self.list_widget.addItem(event.image_path)
+        if event.image_path != self.current_image:
+            return
+        entry = event.entry
+        if event.kind == EVENT_ADDED:
+            if self.overlay_cache is not None:
+                self.overlay_cache.add(entry.id, entry.get_mask(), entry.label, get_label_color(entry.label))
+            self._add_seg_row(entry)
+        elif event.kind == EVENT_REMOVED:
+            if self.overlay_cache is not None:
+                self.overlay_cache.remove(entry.id)
+            self._remove_seg_row(entry.id)
+            if self.selected_segmentation_id == entry.id:
+                self.selected_segmentation_id = None
+        elif event.kind == EVENT_UPDATED:
+            if self.overlay_cache is not None:
+                self.overlay_cache.update(entry.id, entry.get_mask(), entry.label, get_label_color(entry.label))
+            self._restyle_seg_row(entry.id)
+        self.update_overlay()
+
     def update_overlay(self):
-        print("\n=== DEBUG: Začátek update_overlay ===")
         try:
-            if self.current_np_image is not None and self.current_segmentations is not None:
-                print("Připravuji overlay...")
-                segs = [segmentation_entry_to_dict(e) for e in self.current_segmentations]
-                print(f"Počet segmentací pro overlay: {len(segs)}")
-                
-                for i, s in enumerate(segs):
-                    s['color'] = get_label_color(s['label'])
-                    if i == self.selected_segmentation_idx:
-                        s['outline_width'] = 8
-                    else:
-                        s['outline_width'] = 4
-                    
-                print("Vykresluji overlay...")
-                pixmap = draw_segmentation_overlay(self.current_np_image, segs)
+            if self.overlay_cache is not None:
+                widths = {}
+                if self.selected_segmentation_id is not None:
+                    widths[self.selected_segmentation_id] = 8
+                pixmap = self.overlay_cache.render(widths)
                 self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
-                print("Overlay vykreslen")
-            else:
-                print("Není co vykreslovat - chybí obrázek nebo segmentace")
-            
         except Exception as e:
             print(f"\n!!! CHYBA v update_overlay !!!")
             print(f"Typ chyby: {type(e).__name__}")
             print(f"Chybová zpráva: {str(e)}")
             print("Traceback:")
-            import traceback
             traceback.print_exc()
-        
-        print("=== DEBUG: Konec update_overlay ===\n")
+
+    def widget_to_image(self, pos):
+        # Převod souřadnic v image_label na pixel obrázku (pixmapa je centrovaná a zmenšená)
+        pixmap = self.image_label.pixmap()
+        if pixmap is None or self.current_np_image is None:
+            return None
+        img_h, img_w = self.current_np_image.shape[:2]
+        pm_w, pm_h = pixmap.width(), pixmap.height()
+        if pm_w == 0 or pm_h == 0:
+            return None
+        x = pos.x() - (self.image_label.width() - pm_w) // 2
+        y = pos.y() - (self.image_label.height() - pm_h) // 2
+        if not (0 <= x < pm_w and 0 <= y < pm_h):
+            return None
+        return int(x * img_w / pm_w), int(y * img_h / pm_h)
+
+    def segmentation_at(self, pos):
+        if self.overlay_cache is None:
+            return None
+        point = self.widget_to_image(pos)
+        if point is None:
+            return None
+        return self.overlay_cache.hit_test(*point)
+
+    def image_clicked(self, event):
+        # Klik do obrázku vybere nejvrchnější segmentaci pod kurzorem
+        if event.button() != Qt.LeftButton:
+            return
+        seg_id = self.segmentation_at(event.pos())
+        if seg_id is not None and seg_id != self.selected_segmentation_id:
+            self.select_segmentation(seg_id)
+        event.accept()
+
+    def image_mouse_move(self, event):
+        # Hover jen mění text ve stavovém řádku, overlay se nepřekresluje
+        seg_id = self.segmentation_at(event.pos())
+        if seg_id == self.hovered_segmentation_id:
+            return
+        self.hovered_segmentation_id = seg_id
+        entry = None
+        if seg_id is not None:
+            entry = self.seg_storage.get_segmentation(self.current_image, seg_id)
+        if entry is not None:
+            self.statusBar().showMessage(f"{entry.label} (id {seg_id})")
+            self.image_label.setCursor(Qt.PointingHandCursor)
+        else:
+            self.statusBar().clearMessage()
+            self.image_label.unsetCursor()
 
     def resizeEvent(self, event):
         self.update_overlay()
         super().resizeEvent(event)
 
+    def closeEvent(self, event):
+        self.seg_storage.unsubscribe(self.on_storage_event)
+        super().closeEvent(event)
+
     def load_image(self, path):
         # Načte obrázek jako numpy array (RGB)
         from skimage.io import imread
-        img = imread(path)
+        from display_lut import DisplayLUT, to_index_image
+        img = to_index_image(imread(path))
         if img.ndim == 2:
             img = np.stack([img]*3, axis=-1)
-        elif img.shape[2] == 4:
-            img = img[..., :3]
-        return img
+        # 16bitové obrázky přes výchozí okno na uint8
+        return DisplayLUT(img).apply(img)
 
     def load_image_from_disk(self):
         if not self.current_image:
             QMessageBox.warning(self, "Varování", "Nejprve vyberte obrázek v seznamu.")
             return
-        fname, _ = QFileDialog.getOpenFileName(self, "Vyberte obrázek", "", "Obrázky (*.png *.jpg *.jpeg *.bmp)")
+        fname, _ = QFileDialog.getOpenFileName(self, "Vyberte obrázek", "", IMAGE_FILE_FILTER)
         if fname:
             try:
                 np_img = self.load_image(fname)
-                self.current_np_image = np_img
+                self.set_np_image(np_img)
                 self.update_overlay()
             except Exception as e:
                 print("Chyba při načítání obrázku:")
                 traceback.print_exc()
                 QMessageBox.critical(self, "Chyba", f"Nelze načíst obrázek: {fname}\n{e}")
 
+    def show_qa_report(self):
+        try:
+            report = run_qa(self.seg_storage)
+        except Exception:
+            print("Chyba při kontrole anotací:")
+            traceback.print_exc()
+            return
+        dlg = QDialog(self)
+        dlg.setWindowTitle('Kontrola kvality anotací')
+        layout = QVBoxLayout()
+        text = QTextEdit()
+        text.setReadOnly(True)
+        text.setText(format_report(report))
+        layout.addWidget(text)
+        btns = QDialogButtonBox(QDialogButtonBox.Ok)
+        btns.accepted.connect(dlg.accept)
+        layout.addWidget(btns)
+        dlg.setLayout(layout)
+        dlg.resize(600, 500)
+        dlg.exec_()
+
     def update_seg_panel(self):
-        print("\n=== DEBUG: Začátek update_seg_panel ===")
+        # Úplné přestavění panelu - jen při změně obrázku, jinak viz _add_seg_row/_remove_seg_row
         try:
-            print("Mažu staré widgety...")
             while self.seg_layout.count():
                 child = self.seg_layout.takeAt(0)
                 if child.widget():
                     child.widget().deleteLater()
-            
-            if not self.current_segmentations:
-                print("Žádné segmentace k zobrazení")
-                return
-            
-            print(f"Vytvářím tlačítka pro {len(self.current_segmentations)} segmentací")
-            for idx, seg in enumerate(self.current_segmentations):
-                print(f"Vytvářím tlačítko pro segmentaci {idx}: {seg.label}")
-                color = get_label_color(seg.label)
-                row = QHBoxLayout()
-                
-                color_frame = QFrame()
-                color_frame.setFixedSize(18, 18)
-                color_frame.setStyleSheet(f"background: {color.name()}; border: 2px solid {color.name()}; border-radius: 4px;")
-                row.addWidget(color_frame)
-                
-                label_btn = QPushButton(seg.label)
-                label_btn.setStyleSheet(self._label_btn_style(idx, color))
-                label_btn.clicked.connect(lambda _, i=idx: self.select_segmentation(i))
-                row.addWidget(label_btn)
-                
-                remove_btn = QPushButton('Smazat')
-                remove_btn.setStyleSheet("padding: 2px 8px;")
-                remove_btn.clicked.connect(lambda _, i=idx: self.remove_segmentation(i))
-                row.addWidget(remove_btn)
-                
-                row_widget = QWidget()
-                row_widget.setLayout(row)
-                self.seg_layout.addWidget(row_widget)
-            
-            print("Přidávám stretch...")
+            self.seg_rows = {}
+            for seg in self.current_segmentations:
+                self.seg_layout.addWidget(self._make_seg_row(seg))
             self.seg_layout.addStretch(1)
-            print("=== DEBUG: Konec update_seg_panel ===\n")
-            
         except Exception as e:
             print(f"\n!!! CHYBA v update_seg_panel !!!")
             print(f"Typ chyby: {type(e).__name__}")
             print(f"Chybová zpráva: {str(e)}")
             print("Traceback:")
-            import traceback
             traceback.print_exc()
 
-    def _label_btn_style(self, idx, color):
-        if idx == self.selected_segmentation_idx:
+    def _make_seg_row(self, seg):
+        color = get_label_color(seg.label)
+        row = QHBoxLayout()
+
+        color_frame = QFrame()
+        color_frame.setFixedSize(18, 18)
+        color_frame.setStyleSheet(f"background: {color.name()}; border: 2px solid {color.name()}; border-radius: 4px;")
+        row.addWidget(color_frame)
+
+        label_btn = QPushButton(seg.label)
+        label_btn.setStyleSheet(self._label_btn_style(seg.id, color))
+        label_btn.clicked.connect(lambda _, i=seg.id: self.select_segmentation(i))
+        row.addWidget(label_btn)
+
+        remove_btn = QPushButton('Smazat')
+        remove_btn.setStyleSheet("padding: 2px 8px;")
+        remove_btn.clicked.connect(lambda _, i=seg.id: self.remove_segmentation(i))
+        row.addWidget(remove_btn)
+
+        row_widget = QWidget()
+        row_widget.setLayout(row)
+        self.seg_rows[seg.id] = (row_widget, label_btn, color_frame)
+        return row_widget
+
+    def _add_seg_row(self, seg):
+        # Vloží řádek před koncový stretch
+        self.seg_layout.insertWidget(max(self.seg_layout.count() - 1, 0), self._make_seg_row(seg))
+
+    def _remove_seg_row(self, seg_id):
+        row = self.seg_rows.pop(seg_id, None)
+        if row is not None:
+            self.seg_layout.removeWidget(row[0])
+            row[0].deleteLater()
+
+    def _restyle_seg_row(self, seg_id):
+        row = self.seg_rows.get(seg_id)
+        entry = self.seg_storage.get_segmentation(self.current_image, seg_id)
+        if row is None or entry is None:
+            return
+        _, label_btn, color_frame = row
+        color = get_label_color(entry.label)
+        label_btn.setText(entry.label)
+        label_btn.setStyleSheet(self._label_btn_style(seg_id, color))
+        color_frame.setStyleSheet(f"background: {color.name()}; border: 2px solid {color.name()}; border-radius: 4px;")
+
+    def _label_btn_style(self, seg_id, color):
+        if seg_id == self.selected_segmentation_id:
             return f"font-weight: bold; background: {color.lighter(170).name()}; padding: 2px 8px; border: 2px solid {color.name()}; border-radius: 6px;"
         else:
             return f"font-weight: normal; background: none; padding: 2px 8px; border: 2px solid {color.name()}; border-radius: 6px;"
 
-    def select_segmentation(self, idx):
-        self.selected_segmentation_idx = idx
-        self.update_seg_panel()
+    def select_segmentation(self, seg_id):
+        previous = self.selected_segmentation_id
+        self.selected_segmentation_id = seg_id
+        for i in {previous, seg_id}:
+            if i is not None:
+                self._restyle_seg_row(i)
         self.update_overlay()
 
-    def remove_segmentation(self, idx):
-        if self.current_image and 0 <= idx < len(self.current_segmentations):
+    def remove_segmentation(self, seg_id):
+        # Smaže ve storage, UI se upraví přes on_storage_event
+        if self.current_image:
             try:
-                seg = self.current_segmentations[idx]
-                seg_id = getattr(seg, 'id', None)
-                
-                # Odstraníme segmentaci z lokálního seznamu
-                self.current_segmentations = self.current_segmentations[:idx] + self.current_segmentations[idx+1:]
-                self.selected_segmentation_idx = None
-                
-                # Aktualizujeme UI
-                self.update_seg_panel()
-                self.update_overlay()
-                
-                # Až po úspěšné aktualizaci UI zavoláme callback
-                if self.on_delete_segmentation and seg_id is not None:
-                    self.on_delete_segmentation(self.current_image, seg_id)
-                
+                self.seg_storage.remove_segmentation_by_id(self.current_image, seg_id)
             except Exception as e:
                 print(f"Chyba při mazání segmentace: {e}")
-                if self.current_image in self.segmentations_by_image:
-                    self.current_segmentations = self.segmentations_by_image[self.current_image]
-                    self.update_seg_panel()
-                    self.update_overlay()
+                traceback.print_exc()
 
     def keyPressEvent(self, event):
-        if self.current_segmentations and self.selected_segmentation_idx is not None:
+        if self.current_segmentations and self.selected_segmentation_id is not None:
+            ids = [e.id for e in self.current_segmentations]
+            idx = ids.index(self.selected_segmentation_id) if self.selected_segmentation_id in ids else None
             if event.key() == Qt.Key_Up:
-                if self.selected_segmentation_idx > 0:
-                    self.selected_segmentation_idx -= 1
-                    self.update_seg_panel()
-                    self.update_overlay()
+                if idx is not None and idx > 0:
+                    self.select_segmentation(ids[idx - 1])
                 event.accept()
                 return
             elif event.key() == Qt.Key_Down:
-                if self.selected_segmentation_idx < len(self.current_segmentations) - 1:
-                    self.selected_segmentation_idx += 1
-                    self.update_seg_panel()
-                    self.update_overlay()
+                if idx is not None and idx < len(ids) - 1:
+                    self.select_segmentation(ids[idx + 1])
                 event.accept()
                 return
             elif event.key() == Qt.Key_Delete:
-                self.remove_segmentation(self.selected_segmentation_idx)
+                self.remove_segmentation(self.selected_segmentation_id)
                 event.accept()
                 return
         super().keyPressEvent(event)
-
-    def refresh_segmentations(self, segmentations_by_image):
-        # Aktualizujeme pouze data, UI necháme být
-        self.segmentations_by_image = segmentations_by_image
-        self.image_paths = list(segmentations_by_image.keys())
-        
-        if self.current_image in self.image_paths:
-            self.current_segmentations = self.segmentations_by_image[self.current_image]
-            if self.current_segmentations is None:
-                self.current_segmentations = []
\ No newline at end of file